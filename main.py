@@ -3,7 +3,8 @@ import subprocess
 
 import streamlit as st
 
-from modules.streamlit_functions import confirmation_form, uploader
+from modules.settings import STREAMING_EXTRACTION
+from modules.streamlit_functions import confirmation_form, start_warm_up, uploader
 
 st.set_page_config(page_title="Car Mileage Analysis", page_icon="🚗")
 
@@ -15,6 +16,31 @@ def lazy_load_extract_data(image):
     return extract_data(image)
 
 
+def lazy_load_start_extraction(image):
+    """Lazy load function starting data extraction in background."""
+    from modules.data_processing import start_extraction
+
+    return start_extraction(image)
+
+
+def streaming_extraction(image):
+    """Start extraction and return data as soon as car type is known, mileage follows later."""
+    st.session_state.extraction = lazy_load_start_extraction(image)
+    return st.session_state.extraction.partial()
+
+
+def finish_streaming_extraction():
+    """Wait for OCR of started extraction and rerun to fill mileage in the form."""
+    extraction = st.session_state.get("extraction")
+    if extraction is None:
+        return
+    st.session_state.extraction = None
+    complete_data = extraction.result()
+    if complete_data != st.session_state.extracted_data:
+        st.session_state.extracted_data = complete_data
+        st.rerun()
+
+
 def image_processing():
     """Left column handles image upload and preview."""
     st.session_state.image = uploader()
@@ -23,11 +49,15 @@ def image_processing():
         st.image(st.session_state.image, use_column_width=True)
         # preprocessed_img = preprocess(img)  #Potential image preprocessing here
         if not st.session_state.image_processed:
-            st.session_state.extracted_data = lazy_load_extract_data(st.session_state.image)
+            if STREAMING_EXTRACTION:
+                st.session_state.extracted_data = streaming_extraction(st.session_state.image)
+            else:
+                st.session_state.extracted_data = lazy_load_extract_data(st.session_state.image)
             st.session_state.image_processed = True
 
 
 def main():
+    start_warm_up()
     if "image" not in st.session_state:
         st.session_state.image = None
     if "image_processed" not in st.session_state:
@@ -43,6 +73,8 @@ def main():
     with right_col:
         confirmation_form(st.session_state.extracted_data)
 
+    finish_streaming_extraction()
+
 
 if __name__ == "__main__":
     if not os.environ.get("RUNNING"):
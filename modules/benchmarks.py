@@ -0,0 +1,409 @@
+# Offline reports measuring speed and quality of the recognition pipeline on the training dataset
+import argparse
+import os
+import sys
+import time
+
+import pandas as pd
+
+from modules.settings import PREPROCESSING_RECIPES, TRAINING_DATASET, TRAINING_JSON
+
+FOLDER_LABELS = {"car": "Osobowy", "truck": "Dostawczy"}  # Training dataset subfolders and their car types
+
+
+class CheckFailed(AssertionError):
+    """A check found results that differ from the expected ones."""
+
+
+def dataset_images(limit=None):
+    """List image paths from the training dataset."""
+    paths = []
+    for root, _, files in os.walk(TRAINING_DATASET):
+        for file in files:
+            if file.lower().endswith((".png", ".jpg", ".jpeg")):
+                paths.append(os.path.join(root, file))
+    return sorted(paths)[:limit]
+
+
+def labelled_images(limit=None):
+    """Return training image paths with car type label taken from their folder name."""
+    paths, labels = [], []
+    for path in dataset_images():
+        folder = os.path.basename(os.path.dirname(path)).lower()
+        if folder in FOLDER_LABELS:
+            paths.append(path)
+            labels.append(FOLDER_LABELS[folder])
+    return paths[:limit], labels[:limit]
+
+
+def state_dict_megabytes(model):
+    """Size of model weights serialized to memory."""
+    import io
+
+    import torch
+
+    buffer = io.BytesIO()
+    torch.save(model.state_dict(), buffer)
+    return buffer.tell() / 1024**2
+
+
+def process_memory_megabytes():
+    """Resident memory of this process with psutil, else its peak so far from resource, None if neither works."""
+    try:
+        import psutil
+
+        return psutil.Process().memory_info().rss / 1024**2
+    except ImportError:
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss  # Bytes on macOS, kilobytes elsewhere
+    return peak / 1024**2 if sys.platform == "darwin" else peak / 1024
+
+
+def model_memory_megabytes(builder, args=()):
+    """Memory taken by building a model with detection_model.builder(*args) and running one inference on it."""
+    import torch
+
+    import modules.detection_model as detection_model
+
+    before = process_memory_megabytes()
+    model = getattr(detection_model, builder)(*args)
+    with torch.no_grad():
+        model(torch.zeros(1, 3, 224, 224))
+    after = process_memory_megabytes()
+    return None if before is None else after - before
+
+
+def isolated_model_memory(builder, args=()):
+    """model_memory_megabytes measured in a fresh process, so models loaded before don't count."""
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+
+    with ProcessPoolExecutor(1, mp_context=multiprocessing.get_context("spawn")) as executor:
+        return executor.submit(model_memory_megabytes, builder, args).result()
+
+
+def classifier_report(models, limit=None, only=None):
+    """Compare accuracy, agreement with the first model, latency, memory and weight size of named classifier models.
+
+    models maps names to (builder name in detection_model, arguments). Each model is built only for its own
+    measurement, and its memory is measured separately in a fresh process. only restricts the labelled images
+    to the given paths.
+    """
+    import modules.detection_model as detection_model
+    import modules.inference as inference
+
+    paths, labels = labelled_images()
+    if only is not None:
+        selected = {os.path.normpath(path) for path in only}
+        pairs = [(path, label) for path, label in zip(paths, labels) if os.path.normpath(path) in selected]
+        paths, labels = [path for path, _ in pairs], [label for _, label in pairs]
+    paths, labels = paths[:limit], labels[:limit]
+    if not paths:
+        return pd.DataFrame()
+
+    rows, reference = [], None
+    for name, (builder, args) in models.items():
+        model = getattr(detection_model, builder)(*args)
+        start = time.perf_counter()
+        predictions = inference.identify_cars(paths, backend=inference.TorchBackend(model))
+        elapsed = time.perf_counter() - start
+        reference = reference or predictions
+        rows.append(
+            {
+                "model": name,
+                "accuracy": sum(p == l for p, l in zip(predictions, labels)) / len(labels),
+                "agreement": sum(p == r for p, r in zip(predictions, reference)) / len(reference),
+                "ms_per_image": elapsed * 1000 / len(paths),
+                "memory_mb": isolated_model_memory(builder, args),
+                "weights_mb": state_dict_megabytes(model),
+            }
+        )
+    return pd.DataFrame(rows).set_index("model")
+
+
+def quantization_report(limit=None):
+    """Compare int8 quantized classifier with the float32 original on the labelled training set."""
+    models = {"fp32": ("build_model", ("original",)), "int8": ("build_quantized_model", ())}
+    return classifier_report(models, limit)
+
+
+def architecture_report(limit=None):
+    """Compare compact distilled classifier with the original architecture on images held out of distillation."""
+    from modules.distillation import holdout_paths
+
+    models = {"original": ("build_model", ("original",)), "compact": ("build_model", ("compact",))}
+    return classifier_report(models, limit, only=holdout_paths())
+
+
+def known_mileages():
+    """Map training image paths to mileage recorded in training JSON."""
+    try:
+        records = pd.read_json(TRAINING_JSON)
+    except (FileNotFoundError, ValueError):
+        return {}
+    if records.empty:
+        return {}
+    return dict(zip(records["Filename"], records["Mileage"].astype(str)))
+
+
+def ocr_report(variants, limit=None):
+    """Compare OCR latency, hit rate and accuracy of named mileage_ocr keyword argument sets."""
+    import modules.ocr as ocr
+
+    paths = dataset_images(limit)
+    expected = known_mileages()
+    ocr.get_reader()
+
+    rows = []
+    for variant, kwargs in variants.items():
+        for path in paths:
+            start = time.perf_counter()
+            mileage = ocr.best_mileage(ocr.mileage_ocr(path, **kwargs))
+            elapsed = time.perf_counter() - start
+            rows.append(
+                {
+                    "variant": variant,
+                    "seconds": elapsed,
+                    "hit": mileage is not None,
+                    "correct": path in expected and mileage == expected[path],
+                    "labelled": path in expected,
+                }
+            )
+
+    results = pd.DataFrame(rows)
+    if results.empty:
+        return results
+    report = results.groupby("variant", sort=False).agg(
+        images=("hit", "size"),
+        mean_seconds=("seconds", "mean"),
+        hit_rate=("hit", "mean"),
+        correct=("correct", "sum"),
+        labelled=("labelled", "sum"),
+    )
+    report["accuracy"] = report["correct"] / report["labelled"].where(report["labelled"] > 0)
+    return report
+
+
+def roi_report(limit=None):
+    """Compare OCR latency and hit rate with and without odometer cropping."""
+    return ocr_report({"full frame": {"crop": False}, "cropped": {"crop": True}}, limit)
+
+
+def preprocessing_report(recipes=None, limit=None):
+    """Compare OCR accuracy and time, preprocessing included, for each preprocessing recipe."""
+    recipes = recipes or list(PREPROCESSING_RECIPES)
+    return ocr_report({recipe: {"preprocessing": recipe} for recipe in recipes}, limit)
+
+
+def classifier_throughput(batch_sizes=(1, 8, 32), limit=64):
+    """Measure car type classification throughput in images per second for each batch size."""
+    import modules.inference as inference
+
+    paths = dataset_images(limit)
+    inference.get_backend()
+
+    rows = []
+    for batch_size in batch_sizes:
+        start = time.perf_counter()
+        inference.identify_cars(paths, batch_size=batch_size)
+        elapsed = time.perf_counter() - start
+        rows.append({"batch_size": batch_size, "images": len(paths), "seconds": elapsed})
+
+    report = pd.DataFrame(rows)
+    if not report.empty:
+        report["images_per_second"] = report["images"] / report["seconds"]
+    return report
+
+
+def backend_parity(limit=16, tolerance=1e-3):
+    """Check that every available inference backend returns the same outputs as the fp32 PyTorch model.
+
+    Exports are made from the fp32 model, so it is the reference even with MODEL_QUANTIZED. Training images are
+    used if there are any, a seeded random batch otherwise. Backends whose exported model file or runtime is
+    missing are reported as unavailable.
+    """
+    import numpy as np
+
+    import modules.inference as inference
+    from modules.detection_model import build_model
+    from modules.settings import MODEL_ARCHITECTURE
+
+    paths = dataset_images(limit)
+    if paths:
+        batch = np.stack([inference.prepare_array(path) for path in paths])
+    else:
+        batch = np.random.default_rng(0).standard_normal((limit, 3, 224, 224), dtype=np.float32)
+    reference = inference.TorchBackend(build_model(MODEL_ARCHITECTURE)).predict(batch)
+
+    rows = []
+    for name, backend_class in inference.BACKENDS.items():
+        try:
+            logits = backend_class().predict(batch)
+        except (ImportError, OSError, RuntimeError) as e:
+            rows.append({"backend": name, "available": False, "error": str(e)})
+            continue
+        difference = float(np.abs(logits - reference).max())
+        rows.append(
+            {
+                "backend": name,
+                "available": True,
+                "max_difference": difference,
+                "same_labels": inference.to_labels(logits) == inference.to_labels(reference),
+                "matches": difference <= tolerance,
+            }
+        )
+    return pd.DataFrame(rows).set_index("backend")
+
+
+def check_backend_parity(limit=16, tolerance=1e-3):
+    """Run backend_parity and raise CheckFailed if an available backend differs from the reference."""
+    report = backend_parity(limit, tolerance)
+    failed = [
+        name for name, row in report.iterrows() if row["available"] and not (row["matches"] and row["same_labels"])
+    ]
+    if failed:
+        raise CheckFailed(f"Backends differ from the fp32 PyTorch model: {', '.join(failed)}\n{report}")
+    return report
+
+
+def stress_records(saves, duplicate_every=4):
+    """Records for save_stress, every n-th one repeats an earlier reading with another note."""
+    records = []
+    for number in range(saves):
+        mileage = 100000 + (number - 1 if number % duplicate_every == duplicate_every - 1 else number)
+        records.append(
+            {
+                "Date": "2024-01-01",
+                "Time": f"{number // 60:02d}:{number % 60:02d}:00",
+                "Mileage": mileage,
+                "Car type": "Dostawczy",
+                "Car": "L3H2",
+                "Notes": f"save {number}",
+            }
+        )
+    return records
+
+
+def with_invalid_records(records, invalid_every=8):
+    """Records with an unreadable one inserted after every n-th, saving it must fail without affecting the others."""
+    mixed = []
+    for number, record in enumerate(records):
+        mixed.append(record)
+        if number % invalid_every == invalid_every - 1:
+            mixed.append({**record, "Mileage": "n/a", "Notes": f"invalid {number}"})
+    return mixed
+
+
+def temporary_store(backend, folder):
+    """Empty store of given backend with its files in folder."""
+    import modules.storage as storage
+
+    if backend == "json":
+        return storage.JsonStore(os.path.join(folder, "mileage.json"))
+    if backend == "jsonl":
+        return storage.JsonlStore(os.path.join(folder, "mileage.json"), os.path.join(folder, "mileage.jsonl"))
+    return storage.SqliteStore(os.path.join(folder, "mileage.db"))
+
+
+def save_stress(saves=48, threads=24, backends=("json", "jsonl", "sqlite")):
+    """Save records from many threads at once, each directly to the store and through the group-commit writer.
+
+    Unreadable records are saved among valid ones, so group commits fail and are retried one by one. Checks
+    that every valid record was stored once, duplicates were reported, merged notes kept and invalid records
+    refused, and compares durable commits and saves per second.
+    """
+    import tempfile
+    from concurrent.futures import ThreadPoolExecutor
+
+    from modules.group_commit import GroupCommitWriter
+
+    valid = stress_records(saves)
+    records = with_invalid_records(valid)
+    unique = len({(record["Date"], record["Car"], record["Mileage"]) for record in valid})
+
+    rows = []
+    for backend in backends:
+        for mode in ("direct", "group_commit"):
+            with tempfile.TemporaryDirectory() as folder:
+                store = temporary_store(backend, folder)
+                writer = GroupCommitWriter(store) if mode == "group_commit" else None
+                save = writer.save if writer else store.add
+
+                def attempt(record):
+                    try:
+                        return save(record)
+                    except ValueError:
+                        return None
+
+                start = time.perf_counter()
+                with ThreadPoolExecutor(max_workers=threads) as executor:
+                    added = list(executor.map(attempt, records))
+                elapsed = time.perf_counter() - start
+                if writer:
+                    writer.close()
+
+                stored = store.read_df()
+                notes = "\n".join(stored["Notes"]).split("\n") if not stored.empty else []
+                refused = [result is None for result in added]
+                rows.append(
+                    {
+                        "backend": backend,
+                        "mode": mode,
+                        "saves": len(records),
+                        "commits": writer.commits if writer else len(records),
+                        "seconds": elapsed,
+                        "saves_per_second": len(records) / elapsed,
+                        "correct": len(stored) == unique
+                        and sum(result is True for result in added) == unique
+                        and refused == [record["Mileage"] == "n/a" for record in records]
+                        and sorted(notes) == sorted(record["Notes"] for record in valid),
+                    }
+                )
+    return pd.DataFrame(rows).set_index(["backend", "mode"])
+
+
+def check_save_stress(saves=48, threads=24, backends=("json", "jsonl", "sqlite")):
+    """Run save_stress and raise CheckFailed if any backend or mode lost, doubled or wrongly accepted a save."""
+    report = save_stress(saves, threads, backends)
+    failed = [f"{backend} {mode}" for backend, mode in report.index[~report["correct"].astype(bool)]]
+    if failed:
+        raise CheckFailed(f"Saves stored incorrectly: {', '.join(failed)}\n{report}")
+    return report
+
+
+def run_checks():
+    """Run checks that need no training dataset, return exit code 1 if any of them failed."""
+    exit_code = 0
+    for check in (check_save_stress, check_backend_parity):
+        try:
+            print(check())
+        except CheckFailed as e:
+            print(f"{check.__name__} failed: {e}", file=sys.stderr)
+            exit_code = 1
+    return exit_code
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Speed and quality reports of the recognition pipeline.")
+    parser.add_argument(
+        "command",
+        nargs="?",
+        default="report",
+        choices=["report", "check"],
+        help="report: print all reports on the training dataset, check: verify storage and inference backends",
+    )
+    args = parser.parse_args()
+
+    if args.command == "check":
+        sys.exit(run_checks())
+    print(roi_report())
+    print(preprocessing_report())
+    print(classifier_throughput())
+    print(quantization_report())
+    print(architecture_report())
+    print(backend_parity())
+    print(save_stress())
@@ -4,8 +4,9 @@ from sklearn.linear_model import LinearRegression
 from sklearn.pipeline import make_pipeline
 from sklearn.preprocessing import PolynomialFeatures
 
-from modules.data_processing import open_json_as_df
-from modules.settings import JSON_FILE
+from modules.data_processing import open_json_as_df, read_database
+from modules.schema import day_ordinal, to_records_frame
+from modules.storage import cached_frame, file_version
 
 
 def show_chart(df, legend_column="Car type", trend_lines=None):
@@ -19,14 +20,17 @@ def show_chart(df, legend_column="Car type", trend_lines=None):
     return chart
 
 
-def read_and_format_json(json=JSON_FILE):
-    """Load data from training dataset JSON file."""
+def read_and_format_json(json=None):
+    """Load typed records from JSON file, mileage database if none is given, converted again only after changes."""
+    if json is None:
+        return read_database()
+    return cached_frame(("records", json), file_version(json), lambda: format_records(json))
+
+
+def format_records(json):
+    """Read JSON file into typed records sorted by date, empty dataframe if it can't be read."""
     try:
-        df = open_json_as_df(json)
-        df["Date"] = pd.to_datetime(df["Date"])
-        df["Time"] = pd.to_datetime(df["Time"], format="%H:%M:%S").dt.strftime("%H:%M")
-        df = df.sort_values("Date")
-        return df
+        return to_records_frame(open_json_as_df(json), json)
     except:
         return pd.DataFrame()
 
@@ -123,7 +127,7 @@ def prediction_model(x, y):
 def predict_trend(df):
     """Predict trend for a specific car name."""
     trend_df = df.copy()
-    x = df["Date"].map(pd.Timestamp.toordinal).values.reshape(-1, 1)
+    x = df["Day"].values.reshape(-1, 1)
     y = df["Mileage"].values
 
     model = prediction_model(x, y)
@@ -155,8 +159,8 @@ def predict_future_trend(df, target_date):
     future_dates = pd.date_range(start=df["Date"].min(), end=target_date, freq="ME")
     future_df = pd.DataFrame({"Date": future_dates})
 
-    future_x = future_df["Date"].map(pd.Timestamp.toordinal).values.reshape(-1, 1)
-    x = df["Date"].map(pd.Timestamp.toordinal).values.reshape(-1, 1)
+    future_x = day_ordinal(future_df["Date"]).values.reshape(-1, 1)
+    x = df["Day"].values.reshape(-1, 1)
     y = df["Mileage"].values
 
     model = prediction_model(x, y)
@@ -0,0 +1,82 @@
+# Command line batch runner for training dataset processing and database rebuild
+import argparse
+import json
+import sys
+import time
+
+from modules.settings import TRAINING_EXECUTION, TRAINING_JSON, TRAINING_WORKERS
+
+EXIT_OK = 0
+EXIT_ERROR = 1  # Unexpected exception, summary contains the error
+EXIT_NO_DATA = 3  # Rebuild had nothing to save
+
+
+def progress_printer(stream=sys.stderr):
+    """on_result callback printing one line per processed image."""
+
+    def on_result(index, total, rel_path, extracted, status):
+        print(f"[{index + 1}/{total}] {rel_path}: {status}", file=stream, flush=True)
+
+    return on_result
+
+
+def run_process(args):
+    """Process new and changed training images, returns summary and exit code."""
+    from modules.training_dataset import process_training_dataset
+
+    on_result = None if args.quiet else progress_printer()
+    summary = process_training_dataset(
+        workers=args.workers, on_result=on_result, retry_failed=args.retry_failed, execution=args.execution
+    )
+    return summary, EXIT_OK
+
+
+def run_rebuild(args):
+    """Rebuild database from training JSON, returns summary and exit code."""
+    from modules.rebuild import rebuild_database
+
+    summary = rebuild_database(source=args.source, target_file=args.output)
+    return summary, EXIT_OK if summary["saved"] else EXIT_NO_DATA
+
+
+def run_all(args):
+    """Process training dataset, then rebuild database from it."""
+    process_summary, _ = run_process(args)
+    rebuild_summary, exit_code = run_rebuild(args)
+    return {"process": process_summary, "rebuild": rebuild_summary}, exit_code
+
+
+COMMANDS = {"process": run_process, "rebuild": run_rebuild, "all": run_all}
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        description="Run training dataset processing and database rebuild without Streamlit.",
+        epilog=f"Exit codes: {EXIT_OK} success, {EXIT_ERROR} error, {EXIT_NO_DATA} nothing to rebuild.",
+    )
+    parser.add_argument("command", choices=list(COMMANDS), help="process, rebuild or all (process, then rebuild)")
+    parser.add_argument("--workers", type=int, default=TRAINING_WORKERS, help="worker processes in batch execution")
+    parser.add_argument("--execution", choices=["batch", "pipeline"], default=TRAINING_EXECUTION)
+    parser.add_argument("--retry-failed", action="store_true", help="process unreadable, multi-read and failed images again")
+    parser.add_argument("--source", default=TRAINING_JSON, help="training JSON used by rebuild")
+    parser.add_argument("--output", help="JSON file written by rebuild instead of configured database")
+    parser.add_argument("--quiet", action="store_true", help="no per-image progress on stderr")
+    return parser
+
+
+def main(argv=None) -> int:
+    """Run command and print its JSON summary on stdout, returns exit code."""
+    args = build_parser().parse_args(argv)
+    start = time.perf_counter()
+    try:
+        summary, exit_code = COMMANDS[args.command](args)
+    except Exception as e:
+        summary, exit_code = {"error": f"{type(e).__name__}: {e}"}, EXIT_ERROR
+
+    result = {"command": args.command, "exit_code": exit_code, "seconds": round(time.perf_counter() - start, 2)}
+    print(json.dumps({**result, "summary": summary}, indent=2))
+    return exit_code
+
+
+if __name__ == "__main__":
+    sys.exit(main())
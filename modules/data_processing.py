@@ -1,14 +1,26 @@
-import json
+from concurrent.futures import Future, ThreadPoolExecutor
 
 import pandas as pd
 
-import modules.detection_model as detection_model
+import modules.extraction_cache as extraction_cache
+import modules.inference as inference
 import modules.ocr as ocr
 from modules.date import read_datetime
-from modules.settings import JSON_FILE
+from modules.image import load_image
+from modules.group_commit import get_writer
+from modules.settings import EXTRACTION_WORKERS, JSON_FILE
+from modules.storage import cached_frame, file_version, read_database_df
+
+# OCR and classifier spend most time in native code releasing the GIL, so threads run them in parallel
+_executor = ThreadPoolExecutor(max_workers=EXTRACTION_WORKERS, thread_name_prefix="extraction")
 
 
 def open_json_as_df(file=JSON_FILE):
+    """JSON file as dataframe, parsed again only after the file changed."""
+    return cached_frame(("json", file), file_version(file), lambda: read_json_as_df(file))
+
+
+def read_json_as_df(file):
     try:
         json = pd.read_json(file)
     except:
@@ -16,49 +28,96 @@ def open_json_as_df(file=JSON_FILE):
     return json
 
 
-def extract_data(image) -> list[int, str]:
-    """Extract data from image."""
-    filename = image.name
-    mileage = ocr.mileage_ocr(image)
-    car_type = detection_model.identify_car(image)
-    date, time = read_datetime(filename)
-    return [mileage, car_type, date, time]
+def cached_extraction(image_bytes):
+    """Return cached mileage candidates and car type for image content or None."""
+    entry = extraction_cache.get(image_bytes)
+    if entry is None:
+        return None
+    candidates = [ocr.MileageCandidate(**candidate) for candidate in entry["Mileage candidates"]]
+    return candidates, entry["Car type"]
 
 
-def open_json():
-    """Read JSON file or return empty list."""
-    try:
-        with open(JSON_FILE, "r") as file:
-            return json.load(file)
-    except (FileNotFoundError, json.JSONDecodeError):
-        return []
+def cache_extraction(image_bytes, candidates, car_type):
+    """Store mileage candidates and car type for image content."""
+    extraction_cache.put(image_bytes, [candidate._asdict() for candidate in candidates], car_type)
+    return candidates, car_type
 
 
-def save_json(data):
-    """Save data to JSON file."""
-    try:
-        with open(JSON_FILE, "w") as file:
-            json.dump(data, file, indent=4)
-        return True
-    except Exception as e:
-        print(f"Error saving JSON: {e}")
-        return False
-
-
-def is_duplicate(data, new_record):
-    """Check if record already exists in database."""
-    for duplicate_index, record in enumerate(data):
-        if (
-            record["Date"] == new_record["Date"]
-            and record["Mileage"] == new_record["Mileage"]
-            and record["Car"] == new_record["Car"]
-        ):
-            return duplicate_index
-    return False
+def completed(result):
+    """Future that already holds a result."""
+    future = Future()
+    future.set_result(result)
+    return future
+
+
+class Extraction:
+    """OCR and car type classification of one image running concurrently on a shared thread pool."""
+
+    def __init__(self, image):
+        self.image = load_image(image)
+        self.date, self.time = read_datetime(self.image.name)
+        cached = cached_extraction(self.image.data)
+        self.from_cache = cached is not None
+
+        if self.from_cache:
+            self.candidates, self.car_type = completed(cached[0]), completed(cached[1])
+        else:
+            self.candidates = _executor.submit(ocr.mileage_ocr, self.image)
+            self.car_type = _executor.submit(inference.identify_car, self.image)
+
+    def partial(self) -> list[list, str]:
+        """Wait for car type only and return data with empty mileage if OCR is still running."""
+        car_type = self.car_type.result()
+        candidates = self.candidates.result() if self.candidates.done() else []
+        return [candidates, car_type, self.date, self.time]
+
+    def result(self) -> list[list, str]:
+        """Wait for both steps and return complete data, caching it on first completion."""
+        candidates, car_type = self.candidates.result(), self.car_type.result()
+        if not self.from_cache:
+            cache_extraction(self.image.data, candidates, car_type)
+            self.from_cache = True
+        return [candidates, car_type, self.date, self.time]
+
+
+def start_extraction(image) -> Extraction:
+    """Start extracting data from image without waiting for results."""
+    return Extraction(image)
+
+
+def extract_data(image) -> list[list, str]:
+    """Extract data from image. Mileage is a list of OCR candidates, best first."""
+    return start_extraction(image).result()
+
+
+def extract_data_batch(images) -> list[list[list, str]]:
+    """Extract data from many images, running OCR in batches and skipping cached images."""
+    images = [load_image(image) for image in images]
+    cached = [cached_extraction(image.data) for image in images]
+
+    missing = [index for index, entry in enumerate(cached) if entry is None]
+    batch_candidates = ocr.mileage_ocr_batch([images[index] for index in missing])
+    car_types = inference.identify_cars([images[index] for index in missing])
+    for index, candidates, car_type in zip(missing, batch_candidates, car_types):
+        cached[index] = cache_extraction(images[index].data, candidates, car_type)
+
+    results = []
+    for image, (candidates, car_type) in zip(images, cached):
+        date, time = read_datetime(image.name)
+        results.append([candidates, car_type, date, time])
+    return results
+
+
+def read_database():
+    """All mileage records from configured storage as a dataframe, cached until the storage changes."""
+    return read_database_df()
 
 
 def append_to_json(file_path=None, date=None, time=None, mileage=None, car=None, note=None):
-    """Extract data from file and append it to JSON file."""
+    """Save record in configured storage, merging notes into an existing one. Return True if a new record was added.
+
+    Saves from all sessions go through one writer thread, which commits those arriving together at once.
+    """
     record = {
         "Filename": file_path,
         "Date": str(date),
@@ -68,26 +127,4 @@ def append_to_json(file_path=None, date=None, time=None, mileage=None, car=None,
         "Car": car.name,
         "Notes": note or "",
     }
-
-    data = open_json()
-    if not data:
-        data = [record]
-
-    duplicate = is_duplicate(data, record)
-    if duplicate:
-        merge_notes(data, duplicate, record)
-    else:
-        data.append(record)
-
-    return save_json(data)
-
-
-def merge_notes(data, duplicate, record):
-    """Merge notes from duplicate records."""
-    existing_note = data[duplicate]["Notes"]
-    new_note = record["Notes"]
-
-    if existing_note and new_note:
-        data[duplicate]["Notes"] = f"{existing_note}\n{new_note}"
-    elif new_note:
-        data[duplicate]["Notes"] = new_note
+    return get_writer().save(record)
@@ -1,15 +1,32 @@
+import argparse
+import os
+import threading
+
 import torch
-from PIL import Image
 from torch import nn
 from torchvision import transforms
 
 torch.classes.__path__ = []
-from modules.settings import CAR_TYPES, MODEL_PATH
+from modules.extraction_cache import model_signature
+from modules.settings import (
+    COMPACT_MODEL_PATH,
+    MODEL_ARCHITECTURE,
+    MODEL_PATH,
+    MODEL_QUANTIZED,
+    ONNX_MODEL_PATH,
+    QUANTIZED_MODEL_PATH,
+    TORCHSCRIPT_MODEL_PATH,
+    TORCH_NUM_THREADS,
+)
 
+_model = None
+_model_lock = threading.Lock()
+_thread_cap = None  # CPU threads allowed to this process, set by worker processes sharing the machine
 
-def build_model():
-    """Build a deep learning model to identify the type of a car in an image."""
-    model = nn.Sequential(
+
+def build_network():
+    """Build untrained network architecture used to identify the type of a car in an image."""
+    return nn.Sequential(
         nn.Conv2d(3, 32, kernel_size=3, stride=1, padding=1),  # Convolutional layer
         nn.ReLU(),  # Activation function
         nn.MaxPool2d(kernel_size=2, stride=2),  # Max pooling layer
@@ -21,40 +38,153 @@ def build_model():
         nn.ReLU(),  # Activation function
         nn.Linear(128, 2),  # Output layer
     )
+
+
+def depthwise_block(in_channels, out_channels):
+    """Depthwise separable convolution halving the spatial resolution."""
+    return nn.Sequential(
+        nn.Conv2d(in_channels, in_channels, kernel_size=3, stride=2, padding=1, groups=in_channels, bias=False),
+        nn.BatchNorm2d(in_channels),
+        nn.ReLU(),
+        nn.Conv2d(in_channels, out_channels, kernel_size=1, bias=False),  # Pointwise convolution mixes channels
+        nn.BatchNorm2d(out_channels),
+        nn.ReLU(),
+    )
+
+
+def build_compact_network():
+    """Build small network with depthwise convolutions and global pooling instead of a large dense layer."""
+    return nn.Sequential(
+        nn.Conv2d(3, 16, kernel_size=3, stride=2, padding=1, bias=False),  # 224 -> 112
+        nn.BatchNorm2d(16),
+        nn.ReLU(),
+        depthwise_block(16, 32),  # 112 -> 56
+        depthwise_block(32, 64),  # 56 -> 28
+        depthwise_block(64, 128),  # 28 -> 14
+        depthwise_block(128, 128),  # 14 -> 7
+        nn.AdaptiveAvgPool2d(1),  # Global average pooling
+        nn.Flatten(),
+        nn.Linear(128, 2),  # Output layer
+    )
+
+
+ARCHITECTURES = {
+    "original": (build_network, MODEL_PATH),
+    "compact": (build_compact_network, COMPACT_MODEL_PATH),
+}
+
+
+def build_model(architecture="original"):
+    """Build a deep learning model to identify the type of a car in an image."""
+    build, path = ARCHITECTURES[architecture]
+    model = build()
     # Load the trained model
-    model.load_state_dict(torch.load(MODEL_PATH))
+    model.load_state_dict(torch.load(path, map_location="cpu", weights_only=True))
     model.eval()  # Set the model to evaluation mode
     return model
 
 
-def make_prediction(image, model):
-    """Make a prediction using the model. Model returns 0 or 1"""
-    with torch.no_grad():
-        output = model(image)
-        _, predicted = torch.max(output, dim=1)
-    return CAR_TYPES[predicted.item()]
+def quantize(model):
+    """Convert linear layers of the model to dynamic int8 quantization."""
+    return torch.ao.quantization.quantize_dynamic(model, {nn.Linear}, dtype=torch.qint8)
+
+
+def build_quantized_model():
+    """Build int8 model from converted weights, quantizing float32 weights if none were saved for the current model.
+
+    Weights converted from another MODEL_PATH file, e.g. before the model was retrained, are not used.
+    """
+    if not os.path.exists(QUANTIZED_MODEL_PATH):
+        return quantize(build_model())
+
+    # Packed int8 weights are not plain tensors, so weights_only loading cannot be used for this local file
+    saved = torch.load(QUANTIZED_MODEL_PATH, map_location="cpu", weights_only=False)
+    if saved.get("source") != model_signature(MODEL_PATH):
+        return quantize(build_model())
+
+    model = quantize(build_network().eval())
+    model.load_state_dict(saved["state_dict"])
+    model.eval()
+    return model
+
+
+def convert_to_quantized(output=QUANTIZED_MODEL_PATH):
+    """Quantize the trained model once and save int8 weights with the signature of the float32 file."""
+    model = quantize(build_model())
+    torch.save({"source": model_signature(MODEL_PATH), "state_dict": model.state_dict()}, output)
+    return output
+
 
+def configure_threads(threads=None):
+    """Limit CPU threads used by torch to TORCH_NUM_THREADS and the per-process cap, whichever is lower.
 
-def load_image(image):
-    """Load an image from a file, and return it as a NumPy array."""
-    return Image.open(image).convert("RGB")
+    A cap passed by a worker process is kept, so building the model later can't raise the thread count again.
+    """
+    global _thread_cap
+    if threads:
+        _thread_cap = threads
+    limits = [limit for limit in (TORCH_NUM_THREADS, _thread_cap) if limit]
+    if limits:
+        torch.set_num_threads(min(limits))
 
 
-def transform_image(image):
-    """Transform an image to be compatible with the model."""
-    transform = transforms.Compose(
-        [
-            transforms.Resize((224, 224)),  # Resize the image
-            transforms.ToTensor(),  # Convert the image to a tensor
-            transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225]),  # Normalize the image
-        ]
+def get_model():
+    """Return process-wide model, building it on first use."""
+    global _model
+    with _model_lock:
+        if _model is None:
+            configure_threads()
+            if MODEL_QUANTIZED and MODEL_ARCHITECTURE == "original":
+                _model = build_quantized_model()
+            else:
+                _model = build_model(MODEL_ARCHITECTURE)
+    return _model
+
+
+TRANSFORM = transforms.Compose(
+    [
+        transforms.Resize((224, 224)),  # Resize the image
+        transforms.ToTensor(),  # Convert the image to a tensor
+        transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225]),  # Normalize the image
+    ]
+)
+
+
+def export_torchscript(output=TORCHSCRIPT_MODEL_PATH, architecture=MODEL_ARCHITECTURE):
+    """Save the trained model as TorchScript."""
+    model = build_model(architecture)
+    scripted = torch.jit.trace(model, torch.zeros(1, 3, 224, 224))
+    scripted.save(output)
+    return output
+
+
+def export_onnx(output=ONNX_MODEL_PATH, architecture=MODEL_ARCHITECTURE):
+    """Save the trained model as ONNX with dynamic batch size."""
+    model = build_model(architecture)
+    torch.onnx.export(
+        model,
+        torch.zeros(1, 3, 224, 224),
+        output,
+        input_names=["image"],
+        output_names=["logits"],
+        dynamic_axes={"image": {0: "batch"}, "logits": {0: "batch"}},
     )
-    return transform(image).unsqueeze(0)
+    return output
 
 
-def identify_car(image):
-    """Load a trained model and use it to identify the type of a car in an image."""
-    model = build_model()
-    image = load_image(image)
-    transformed_image = transform_image(image)
-    return make_prediction(transformed_image, model)
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Car type model utilities.")
+    parser.add_argument(
+        "command",
+        choices=["quantize", "export"],
+        help="quantize: save int8 weights to QUANTIZED_MODEL_PATH, export: save TorchScript and ONNX models",
+    )
+    args = parser.parse_args()
+
+    if args.command == "quantize":
+        print(f"Saved quantized model to {convert_to_quantized()}")
+    elif args.command == "export":
+        if MODEL_QUANTIZED:
+            print("Exported models are fp32, MODEL_QUANTIZED only applies to the torch backend")
+        print(f"Saved TorchScript model to {export_torchscript()}")
+        print(f"Saved ONNX model to {export_onnx()}")
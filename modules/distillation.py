@@ -0,0 +1,75 @@
+# Train the compact car type model by distilling predictions of the original model
+import argparse
+
+import torch
+from torch.nn import functional as F
+from torch.utils.data import DataLoader, random_split
+from torchvision import datasets
+
+from modules.detection_model import TRANSFORM, build_compact_network, build_model
+from modules.settings import COMPACT_MODEL_PATH, DISTILLATION_HOLDOUT, DISTILLATION_SEED, TRAINING_DATASET
+
+
+def distillation_loss(student_output, teacher_output, temperature):
+    """KL divergence between softened student and teacher class distributions."""
+    student_log_probs = F.log_softmax(student_output / temperature, dim=1)
+    teacher_probs = F.softmax(teacher_output / temperature, dim=1)
+    return F.kl_div(student_log_probs, teacher_probs, reduction="batchmean") * temperature**2
+
+
+def split_dataset(dataset, holdout=DISTILLATION_HOLDOUT, seed=DISTILLATION_SEED):
+    """Seeded split into distillation and held-out subsets, the same for every run on the same images."""
+    held_out = int(len(dataset) * holdout)
+    generator = torch.Generator().manual_seed(seed)
+    return random_split(dataset, [len(dataset) - held_out, held_out], generator=generator)
+
+
+def holdout_paths():
+    """Paths of training images left out of distillation."""
+    dataset = datasets.ImageFolder(TRAINING_DATASET)
+    _, held_out = split_dataset(dataset)
+    return [dataset.samples[i][0] for i in held_out.indices]
+
+
+def distill(epochs=10, batch_size=16, temperature=4.0, learning_rate=1e-3, output=COMPACT_MODEL_PATH):
+    """Train compact model to reproduce outputs of the original model and save its weights.
+
+    Only teacher outputs are used as targets, so the student keeps the class order of CAR_TYPES
+    regardless of how training dataset folders are named. Images from holdout_paths are not trained on.
+    """
+    train_data, _ = split_dataset(datasets.ImageFolder(TRAINING_DATASET, transform=TRANSFORM))
+    train_loader = DataLoader(train_data, batch_size=batch_size, shuffle=True)
+
+    teacher = build_model("original")
+    student = build_compact_network()
+    optimizer = torch.optim.Adam(student.parameters(), lr=learning_rate)
+
+    for epoch in range(epochs):
+        student.train()
+        total_loss = 0.0
+        for imgs, _ in train_loader:
+            with torch.no_grad():
+                teacher_output = teacher(imgs)
+            loss = distillation_loss(student(imgs), teacher_output, temperature)
+
+            optimizer.zero_grad()
+            loss.backward()
+            optimizer.step()
+            total_loss += loss.item() * len(imgs)
+
+        print(f"Epoch: {epoch+1}, Loss: {total_loss / len(train_data):.4f}")
+
+    student.eval()
+    torch.save(student.state_dict(), output)
+    return student
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Distill compact car type model from the original one.")
+    parser.add_argument("--epochs", type=int, default=10)
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--temperature", type=float, default=4.0)
+    args = parser.parse_args()
+
+    distill(epochs=args.epochs, batch_size=args.batch_size, temperature=args.temperature)
+    print(f"Saved compact model to {COMPACT_MODEL_PATH}")
@@ -0,0 +1,193 @@
+# Persistent cache of OCR and classifier results keyed by image content
+import hashlib
+import json
+import os
+import threading
+
+import pandas as pd
+
+from modules.settings import (
+    COMPACT_MODEL_PATH,
+    EXTRACTION_CACHE_DIR,
+    EXTRACTION_CACHE_MAX_ENTRIES,
+    INFERENCE_BACKEND,
+    MODEL_ARCHITECTURE,
+    MODEL_PATH,
+    MODEL_QUANTIZED,
+    OCR_CROP_ROI,
+    OCR_LANGUAGES,
+    OCR_PREPROCESSING,
+    ONNX_MODEL_PATH,
+    PREPROCESSING_RECIPES,
+    QUANTIZED_MODEL_PATH,
+    TORCHSCRIPT_MODEL_PATH,
+)
+
+CACHE_FORMAT = 2  # Bump when the structure of cached entries changes
+EXPORTED_MODELS = {"torchscript": TORCHSCRIPT_MODEL_PATH, "onnx": ONNX_MODEL_PATH}  # Model file of each backend
+VERSION_FILE = "version.txt"
+EVICT_TO = 0.9  # Share of EXTRACTION_CACHE_MAX_ENTRIES left after eviction, so it runs once per many puts
+
+_lock = threading.Lock()
+_evict_lock = threading.Lock()
+_checked_version = None
+_entries = None  # Approximate number of cached entries, counted on first put and corrected by each eviction
+
+
+def model_signature(path=MODEL_PATH):
+    """Describe model file by path, size and modification time."""
+    try:
+        stat = os.stat(path)
+        return f"{path}:{stat.st_size}:{stat.st_mtime_ns}"
+    except OSError:
+        return f"{path}:missing"
+
+
+def cache_version():
+    """Hash of everything that influences extraction results."""
+    settings = json.dumps(
+        {
+            "format": CACHE_FORMAT,
+            "model": model_signature(),
+            "model_architecture": MODEL_ARCHITECTURE,
+            "compact_model": model_signature(COMPACT_MODEL_PATH),
+            "model_quantized": MODEL_QUANTIZED,
+            "quantized_model": model_signature(QUANTIZED_MODEL_PATH) if MODEL_QUANTIZED else None,
+            "inference_backend": INFERENCE_BACKEND,
+            "exported_model": model_signature(EXPORTED_MODELS[INFERENCE_BACKEND])
+            if INFERENCE_BACKEND in EXPORTED_MODELS
+            else None,
+            "ocr_languages": OCR_LANGUAGES,
+            "ocr_crop_roi": OCR_CROP_ROI,
+            "ocr_preprocessing": PREPROCESSING_RECIPES[OCR_PREPROCESSING],
+        },
+        sort_keys=True,
+    )
+    return hashlib.sha256(settings.encode()).hexdigest()[:16]
+
+
+def image_key(image_bytes):
+    """Content hash of an image."""
+    return hashlib.sha256(image_bytes).hexdigest()
+
+
+def entry_path(key):
+    return os.path.join(EXTRACTION_CACHE_DIR, f"{key}.json")
+
+
+def clear():
+    """Remove all cached entries."""
+    global _entries
+    _entries = None
+    if not os.path.isdir(EXTRACTION_CACHE_DIR):
+        return
+    for name in os.listdir(EXTRACTION_CACHE_DIR):
+        if name.endswith(".json"):
+            remove(os.path.join(EXTRACTION_CACHE_DIR, name))
+
+
+def ensure_version():
+    """Drop cached entries created with a different model or OCR configuration."""
+    global _checked_version
+    version = cache_version()
+    if _checked_version == version:
+        return
+
+    os.makedirs(EXTRACTION_CACHE_DIR, exist_ok=True)
+    version_file = os.path.join(EXTRACTION_CACHE_DIR, VERSION_FILE)
+    try:
+        with open(version_file, "r") as file:
+            stored_version = file.read().strip()
+    except FileNotFoundError:
+        stored_version = None
+
+    if stored_version != version:
+        clear()
+        with open(version_file, "w") as file:
+            file.write(version)
+    _checked_version = version
+
+
+def get(image_bytes):
+    """Return cached extraction result for image content or None."""
+    with _lock:
+        ensure_version()
+        path = entry_path(image_key(image_bytes))
+        try:
+            with open(path, "r") as file:
+                entry = json.load(file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+        try:
+            os.utime(path)  # Mark as recently used
+        except FileNotFoundError:
+            pass  # Evicted by another process in the meantime
+        return entry
+
+
+def put(image_bytes, candidates, car_type):
+    """Store extraction result for image content, evicting least recently used entries once the cache is full."""
+    global _entries
+    entry = {
+        "Mileage candidates": candidates,
+        "Car type": car_type,
+        "Created": pd.Timestamp.now().isoformat(timespec="seconds"),
+    }
+    with _lock:
+        ensure_version()
+        path = entry_path(image_key(image_bytes))
+        added = not os.path.exists(path)
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, "w") as file:
+            json.dump(entry, file)
+        os.replace(temp_path, path)
+        if _entries is None:
+            _entries = count_entries()
+        else:
+            _entries += added
+        full = _entries > EXTRACTION_CACHE_MAX_ENTRIES
+    if full:
+        evict()
+    return entry
+
+
+def count_entries():
+    return sum(1 for entry in os.scandir(EXTRACTION_CACHE_DIR) if entry.name.endswith(".json"))
+
+
+def evict(max_entries=EXTRACTION_CACHE_MAX_ENTRIES, keep=EVICT_TO):
+    """Delete least recently used entries down to keep share of the size limit.
+
+    Runs without the lock of get and put, a thread finding another one evicting returns at once.
+    """
+    global _entries
+    if not _evict_lock.acquire(blocking=False):
+        return
+    try:
+        with _lock:
+            counted = _entries or 0
+        entries = [entry for entry in os.scandir(EXTRACTION_CACHE_DIR) if entry.name.endswith(".json")]
+        excess = max(len(entries) - int(max_entries * keep), 0)
+        entries.sort(key=entry_mtime)
+        for entry in entries[:excess]:
+            remove(entry.path)
+        with _lock:
+            _entries = max(len(entries) - excess + (_entries or 0) - counted, 0)  # Puts during eviction stay counted
+    finally:
+        _evict_lock.release()
+
+
+def entry_mtime(entry):
+    """Modification time of a cache entry, 0 if another process already removed it."""
+    try:
+        return entry.stat().st_mtime_ns
+    except FileNotFoundError:
+        return 0
+
+
+def remove(path):
+    """Delete cache file which may have been already removed by another process."""
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
@@ -0,0 +1,96 @@
+# Single writer thread saving records from concurrent sessions in group commits
+import queue
+import threading
+from concurrent.futures import Future
+
+from modules.settings import GROUP_COMMIT_MAX_RECORDS
+from modules.storage import get_store
+
+STOP = object()  # Queued by close, the writer thread exits after committing saves queued before it
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+class GroupCommitWriter:
+    """Saves queued for one writer thread, which stores all records waiting in the queue with one commit.
+
+    While a commit is written to disk, saves arriving from other sessions wait and go into the next one,
+    so many parallel saves cost a few durable writes instead of one each.
+    """
+
+    def __init__(self, store, max_records=GROUP_COMMIT_MAX_RECORDS):
+        self.store = store
+        self.max_records = max_records
+        self.queue = queue.Queue()
+        self.commits = 0
+        self.saved = 0
+        self.thread = threading.Thread(target=self.run, name="group-commit", daemon=True)
+        self.thread.start()
+
+    def submit(self, record) -> Future:
+        """Queue record, the future resolves to True if it was added or False if notes were merged."""
+        future = Future()
+        self.queue.put((record, future))
+        return future
+
+    def save(self, record):
+        """Save record and wait until it is committed. Return True if it was added."""
+        return self.submit(record).result()
+
+    def close(self):
+        """Commit queued saves and stop the writer thread."""
+        self.queue.put(STOP)
+        self.thread.join()
+
+    def next_group(self):
+        """Wait for the first save, then take the ones already queued behind it."""
+        group = [self.queue.get()]
+        while len(group) < self.max_records:
+            try:
+                group.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return group
+
+    def run(self):
+        while True:
+            group = self.next_group()
+            saves = [item for item in group if item is not STOP]
+            if saves:
+                self.commit(saves)
+            if len(saves) < len(group):
+                return
+
+    def commit(self, saves):
+        """Store records with one commit, retrying one by one if it fails so only invalid records get an error."""
+        try:
+            results = self.store.add_many([record for record, _ in saves])
+        except Exception:
+            for record, future in saves:
+                self.commit_single(record, future)
+            return
+
+        self.commits += 1
+        self.saved += len(saves)
+        for (_, future), added in zip(saves, results):
+            future.set_result(added)
+
+    def commit_single(self, record, future):
+        try:
+            added = self.store.add_many([record])[0]
+        except Exception as e:
+            future.set_exception(e)
+            return
+        self.commits += 1
+        self.saved += 1
+        future.set_result(added)
+
+
+def get_writer():
+    """Return process-wide writer of the configured store, starting its thread on first use."""
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = GroupCommitWriter(get_store())
+    return _writer
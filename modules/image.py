@@ -0,0 +1,56 @@
+# Uploaded image decoded once and shared by OCR, car type classifier and date parsing
+import io
+import threading
+
+import numpy as np
+from PIL import Image, ImageOps
+
+MODEL_INPUT_SIZE = (224, 224)
+
+
+class DecodedImage:
+    """Raw bytes of an image with lazily decoded views, each computed at most once."""
+
+    def __init__(self, data: bytes, name: str = ""):
+        self.data = data
+        self.name = name
+        self._lock = threading.Lock()
+        self._pil = None
+        self._rgb = None
+        self._resized = None
+
+    @property
+    def pil(self) -> Image.Image:
+        """Decoded RGB image in stored orientation, as seen by the classifier during training."""
+        with self._lock:
+            if self._pil is None:
+                self._pil = Image.open(io.BytesIO(self.data)).convert("RGB")
+        return self._pil
+
+    @property
+    def rgb(self) -> np.ndarray:
+        """Full resolution RGB array rotated according to EXIF orientation, used by OCR."""
+        if self._rgb is None:
+            self._rgb = np.asarray(ImageOps.exif_transpose(self.pil))
+        return self._rgb
+
+    @property
+    def resized(self) -> np.ndarray:
+        """RGB array resized to classifier input size."""
+        if self._resized is None:
+            self._resized = np.asarray(self.pil.resize(MODEL_INPUT_SIZE, Image.BILINEAR))
+        return self._resized
+
+
+def load_image(source) -> DecodedImage:
+    """Wrap file path, bytes, uploaded file or already loaded image as DecodedImage."""
+    if isinstance(source, DecodedImage):
+        return source
+    if isinstance(source, str):
+        with open(source, "rb") as file:
+            return DecodedImage(file.read(), source)
+    if isinstance(source, bytes):
+        return DecodedImage(source)
+    if hasattr(source, "getvalue"):
+        return DecodedImage(source.getvalue(), getattr(source, "name", ""))
+    return DecodedImage(source.read(), getattr(source, "name", ""))
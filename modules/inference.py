@@ -0,0 +1,117 @@
+# Car type prediction through interchangeable inference backends
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from modules.image import load_image
+from modules.settings import (
+    CAR_TYPES,
+    CLASSIFIER_BATCH_SIZE,
+    CLASSIFIER_WORKERS,
+    INFERENCE_BACKEND,
+    MODEL_QUANTIZED,
+    ONNX_MODEL_PATH,
+    TORCHSCRIPT_MODEL_PATH,
+)
+
+MEAN = np.array([0.485, 0.456, 0.406], dtype=np.float32)
+STD = np.array([0.229, 0.224, 0.225], dtype=np.float32)
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+class TorchBackend:
+    """Run the PyTorch model from detection_model."""
+
+    def __init__(self, model=None):
+        import modules.detection_model as detection_model
+
+        self.model = model if model is not None else detection_model.get_model()
+
+    def predict(self, batch):
+        import torch
+
+        with torch.inference_mode():
+            return self.model(torch.from_numpy(batch)).numpy()
+
+
+class TorchScriptBackend:
+    """Run the exported TorchScript model without building the network in Python."""
+
+    def __init__(self, path=TORCHSCRIPT_MODEL_PATH):
+        import torch
+
+        self.model = torch.jit.load(path, map_location="cpu").eval()
+
+    def predict(self, batch):
+        import torch
+
+        with torch.inference_mode():
+            return self.model(torch.from_numpy(batch)).numpy()
+
+
+class OnnxBackend:
+    """Run the exported ONNX model on onnxruntime CPU, without importing torch."""
+
+    def __init__(self, path=ONNX_MODEL_PATH):
+        import onnxruntime
+
+        self.session = onnxruntime.InferenceSession(path, providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+
+    def predict(self, batch):
+        return self.session.run(None, {self.input_name: batch})[0]
+
+
+BACKENDS = {"torch": TorchBackend, "torchscript": TorchScriptBackend, "onnx": OnnxBackend}
+
+
+def get_backend():
+    """Return process-wide inference backend selected in settings, loading it on first use."""
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            check_backend_settings()
+            _backend = BACKENDS[INFERENCE_BACKEND]()
+    return _backend
+
+
+def check_backend_settings():
+    """Refuse settings where the selected backend would not run the configured model."""
+    if MODEL_QUANTIZED and INFERENCE_BACKEND != "torch":
+        raise ValueError(
+            f"MODEL_QUANTIZED only applies to the torch backend, {INFERENCE_BACKEND} runs the exported fp32 model. "
+            'Set MODEL_QUANTIZED = False or INFERENCE_BACKEND = "torch".'
+        )
+
+
+def prepare_array(image):
+    """Transform image into a normalized CHW float32 array, same as detection_model.TRANSFORM."""
+    array = load_image(image).resized.astype(np.float32) / 255.0
+    array = (array - MEAN) / STD
+    return array.transpose(2, 0, 1)
+
+
+def to_labels(logits):
+    """Map model outputs to car type labels."""
+    return [CAR_TYPES[index] for index in np.argmax(logits, axis=1).tolist()]
+
+
+def identify_car(image, backend=None):
+    """Identify the type of a car in an image."""
+    return identify_cars([image], batch_size=1, workers=1, backend=backend)[0]
+
+
+def identify_cars(images, batch_size=CLASSIFIER_BATCH_SIZE, workers=CLASSIFIER_WORKERS, backend=None):
+    """Identify car type for each image, decoding in parallel threads and predicting in batches."""
+    backend = backend or get_backend()
+    labels = []
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for start in range(0, len(images), batch_size):
+            chunk = images[start : start + batch_size]
+            batch = np.stack(list(executor.map(prepare_array, chunk)))
+            labels.extend(to_labels(backend.predict(batch)))
+    return labels
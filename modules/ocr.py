@@ -1,15 +1,193 @@
 import re
+import threading
+from typing import NamedTuple
 
-import easyocr
+import numpy as np
 
+from modules.image import load_image
+from modules.preprocessing import crop_to_roi, preprocess_batch, recipe_pipeline
+from modules.settings import (
+    OCR_AMBIGUITY_RATIO,
+    OCR_BATCH_SIZE,
+    OCR_CROP_ROI,
+    OCR_DEVICE,
+    OCR_LANGUAGES,
+    OCR_PREPROCESSING,
+    PREPROCESSING_RECIPES,
+)
 
-def mileage_ocr(img):
-    """Return first 6-digit number from OCR or None."""
-    ocr = easyocr.Reader(["en"], gpu=True)
-    img_bytes = img.read()
-    ocr_result = ocr.readtext(img_bytes, allowlist="0123456789")
+SIZE_BUCKET = 64  # Images within this many pixels share one OCR batch
 
+_reader = None
+_reader_lock = threading.Lock()
+
+
+def use_gpu():
+    """Decide whether OCR should run on GPU based on settings and available hardware."""
+    if OCR_DEVICE == "auto":
+        import torch
+
+        return torch.cuda.is_available()
+    return OCR_DEVICE == "gpu"
+
+
+def get_reader():
+    """Return process-wide easyocr Reader, loading model weights on first use."""
+    global _reader
+    with _reader_lock:
+        if _reader is None:
+            import easyocr
+
+            _reader = easyocr.Reader(OCR_LANGUAGES, gpu=use_gpu())
+    return _reader
+
+
+class MileageCandidate(NamedTuple):
+    """Six-digit number read by OCR with its location and ranking score."""
+
+    value: str
+    confidence: float
+    box: list
+    score: float
+
+
+def find_candidates(ocr_result):
+    """Return 6-digit numbers from raw OCR result ranked by score, best first.
+
+    Score is OCR confidence weighted by text height relative to the tallest text found,
+    because odometer digits are the largest numbers on the dashboard.
+    """
     SIX_DIGITS = r"\b\d{6}\b"
-    six_digit_numbers = re.findall(SIX_DIGITS, str(ocr_result))
+    heights = [box_height(box) for box, _, _ in ocr_result]
+    max_height = max(heights, default=0) or 1
+
+    best = {}
+    for (box, text, confidence), height in zip(ocr_result, heights):
+        for value in re.findall(SIX_DIGITS, text):
+            score = float(confidence) * height / max_height
+            if value not in best or score > best[value].score:
+                points = [[int(x), int(y)] for x, y in box]
+                best[value] = MileageCandidate(value, float(confidence), points, score)
+
+    return sorted(best.values(), key=lambda candidate: candidate.score, reverse=True)
+
+
+def box_height(box):
+    """Height of OCR bounding box given as four corner points."""
+    ys = [y for _, y in box]
+    return max(ys) - min(ys)
+
+
+def best_mileage(candidates):
+    """Return value of the highest ranked candidate or None."""
+    return candidates[0].value if candidates else None
+
+
+def is_ambiguous(candidates, ratio=OCR_AMBIGUITY_RATIO):
+    """Check if runner-up reading scores too close to the best one to choose automatically."""
+    if len(candidates) < 2:
+        return False
+    return candidates[1].score >= candidates[0].score * ratio
+
+
+def mileage_ocr(img, crop=OCR_CROP_ROI, preprocessing=OCR_PREPROCESSING):
+    """Return mileage candidates from OCR ranked by score, best first.
+
+    If the cropped region gives no six-digit number, the crop may have picked the wrong display,
+    so the full frame is read again.
+    """
+    array = prepare_image(img, crop, preprocessing)
+    candidates = read_candidates(array)
+    if crop and not candidates and was_cropped(img, array):
+        candidates = read_candidates(prepare_image(img, False, preprocessing))
+    return candidates
+
+
+def was_cropped(img, array):
+    """Check if crop_to_roi found a region, it returns the full frame otherwise."""
+    return array.shape[:2] != load_image(img).rgb.shape[:2]
+
+
+def read_candidates(array):
+    ocr_result = get_reader().readtext(array, allowlist="0123456789")
+    return find_candidates(ocr_result)
+
+
+def decode_image(img, crop=OCR_CROP_ROI):
+    """Decoded RGB array of the image, optionally cropped to the odometer display."""
+    array = load_image(img).rgb
+    return crop_to_roi(array) if crop else array
+
+
+def prepare_image(img, crop=OCR_CROP_ROI, preprocessing=OCR_PREPROCESSING):
+    """Decoded RGB array of the image, optionally cropped to the odometer display and preprocessed."""
+    return recipe_pipeline(preprocessing)(decode_image(img, crop))
+
+
+def prepare_images(images, crop=OCR_CROP_ROI, preprocessing=OCR_PREPROCESSING):
+    """Arrays of prepare_image for many images, equally sized ones stacked so pixel-wise stages run once."""
+    arrays = [decode_image(img, crop) for img in images]
+    recipe = PREPROCESSING_RECIPES[preprocessing]
+    if not recipe:
+        return arrays
+
+    shapes = {}
+    for index, array in enumerate(arrays):
+        shapes.setdefault(array.shape, []).append(index)
+    prepared = [None] * len(arrays)
+    for indexes in shapes.values():
+        batch = np.stack([arrays[index] for index in indexes]) if len(indexes) > 1 else [arrays[indexes[0]]]
+        for index, array in zip(indexes, preprocess_batch(batch, recipe)):
+            prepared[index] = array
+    return prepared
+
+
+def group_by_size(arrays):
+    """Group image indexes by similar height and width."""
+    groups = {}
+    for index, array in enumerate(arrays):
+        height, width = array.shape[:2]
+        key = (round(height / SIZE_BUCKET), round(width / SIZE_BUCKET))
+        groups.setdefault(key, []).append(index)
+    return list(groups.values())
+
+
+def ocr_group(arrays, batch_size):
+    """Run batched OCR on images of similar size, resizing them to a common shape."""
+    height, width = arrays[0].shape[:2]
+    ocr = get_reader()
+    return ocr.readtext_batched(arrays, n_width=width, n_height=height, batch_size=batch_size, allowlist="0123456789")
+
+
+def mileage_ocr_batch(images, batch_size=OCR_BATCH_SIZE, crop=OCR_CROP_ROI, preprocessing=OCR_PREPROCESSING):
+    """Return mileage candidates for each image, reading similar-sized images in batches.
+
+    Images whose cropped region gives no six-digit number are read again on the full frame, as in mileage_ocr.
+    """
+    images = [load_image(img) for img in images]
+    arrays = prepare_images(images, crop, preprocessing)
+    results = read_candidates_batch(arrays, batch_size)
+    if crop:
+        missed = [
+            index
+            for index, (image, array, candidates) in enumerate(zip(images, arrays, results))
+            if not candidates and was_cropped(image, array)
+        ]
+        full_frames = prepare_images([images[index] for index in missed], False, preprocessing)
+        for index, candidates in zip(missed, read_candidates_batch(full_frames, batch_size)):
+            results[index] = candidates
+    return results
+
+
+def read_candidates_batch(arrays, batch_size=OCR_BATCH_SIZE):
+    """Mileage candidates of each array, OCR run in batches of similar-sized arrays."""
+    results = [[] for _ in arrays]
+
+    for group in group_by_size(arrays):
+        for start in range(0, len(group), batch_size):
+            chunk = group[start : start + batch_size]
+            ocr_results = ocr_group([arrays[index] for index in chunk], batch_size)
+            for index, ocr_result in zip(chunk, ocr_results):
+                results[index] = find_candidates(ocr_result)
 
-    return six_digit_numbers[0] if six_digit_numbers else None
+    return results
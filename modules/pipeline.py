@@ -0,0 +1,95 @@
+# Streaming pipeline of stages connected by bounded queues, each stage running on its own worker threads
+import queue
+import threading
+
+DONE = object()  # Marks end of items flowing through a queue
+POLL_SECONDS = 0.1
+
+
+class Stage:
+    """Function applied to every item by a number of worker threads."""
+
+    def __init__(self, name, func, workers=1):
+        self.name = name
+        self.func = func
+        self.workers = workers
+
+
+def run_pipeline(items, stages, queue_size=4):
+    """Yield results of passing every item through all stages.
+
+    At most queue_size items wait between two stages, so memory stays bounded however many items come in.
+    Order is preserved only when every stage has a single worker. First error raised by a stage is re-raised here.
+    """
+    queues = [queue.Queue(queue_size) for _ in range(len(stages) + 1)]
+    stop = threading.Event()
+    errors = []
+
+    def put(target, item):
+        while not stop.is_set():
+            try:
+                target.put(item, timeout=POLL_SECONDS)
+                return
+            except queue.Full:
+                continue
+
+    def feed():
+        try:
+            for item in items:
+                if stop.is_set():
+                    return
+                put(queues[0], item)
+            put(queues[0], DONE)
+        except Exception as e:
+            errors.append(e)
+            stop.set()
+
+    def work(stage, source, target, remaining, lock):
+        while not stop.is_set():
+            try:
+                item = source.get(timeout=POLL_SECONDS)
+            except queue.Empty:
+                continue
+
+            if item is DONE:
+                source.put(DONE)  # Let other workers of this stage see the end too
+                with lock:
+                    remaining[0] -= 1
+                    last_worker = remaining[0] == 0
+                if last_worker:
+                    put(target, DONE)
+                return
+
+            try:
+                result = stage.func(item)
+            except Exception as e:
+                errors.append(e)
+                stop.set()
+                return
+            put(target, result)
+
+    threads = [threading.Thread(target=feed, name="pipeline-feed", daemon=True)]
+    for stage, source, target in zip(stages, queues, queues[1:]):
+        remaining, lock = [stage.workers], threading.Lock()
+        for number in range(stage.workers):
+            args = (stage, source, target, remaining, lock)
+            threads.append(threading.Thread(target=work, args=args, name=f"pipeline-{stage.name}-{number}", daemon=True))
+
+    for thread in threads:
+        thread.start()
+
+    try:
+        while True:
+            try:
+                item = queues[-1].get(timeout=POLL_SECONDS)
+            except queue.Empty:
+                if errors:
+                    raise errors[0]
+                continue
+            if item is DONE:
+                break
+            yield item
+        if errors:
+            raise errors[0]
+    finally:
+        stop.set()  # Stops workers if consumer finished early or a stage failed
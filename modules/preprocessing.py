@@ -1,8 +1,14 @@
-# v1.01 - preprocessing: gamma correction, erosion, edge detection, sharpening
+# v1.02 - headless preprocessing pipeline: gamma correction, erosion, edge detection, sharpening
+from functools import lru_cache, partial
+from typing import Callable, Optional, Sequence
+
 import cv2
-import matplotlib.pyplot as plt
 import numpy as np
 
+from modules.settings import PREPROCESSING_RECIPES
+
+LEGACY_RECIPE = [("bgr_to_rgb", {}), *PREPROCESSING_RECIPES["legacy"]]  # preprocess() takes BGR images from cv2
+
 
 # 2. ORDER: 1. GAMMA CORRECTION, 2. EROSION, 3. EDGE DETECTION 4. SHARPENING
 def unsharp_mask(
@@ -26,36 +32,107 @@ def unsharp_mask(
     return sharpened
 
 
+@lru_cache(maxsize=32)
+def gamma_table(gamma: float) -> np.ndarray:
+    """
+    Build a lookup table mapping the pixel values [0, 255] to their adjusted gamma values.
+
+    Args:
+        gamma (float): The gamma value.
+
+    Returns:
+        np.ndarray: Read-only uint8 lookup table with 256 entries.
+    """
+    invGamma = 5 / gamma
+    table = (((np.arange(256) / 255.0) ** invGamma) * 255).astype("uint8")
+    table.flags.writeable = False
+    return table
+
+
+@lru_cache(maxsize=32)
+def square_kernel(size: int) -> np.ndarray:
+    """
+    Build a square morphological kernel.
+
+    Args:
+        size (int): Width and height of the kernel.
+
+    Returns:
+        np.ndarray: Read-only uint8 kernel of ones.
+    """
+    kernel = np.ones((size, size), np.uint8)
+    kernel.flags.writeable = False
+    return kernel
+
+
 def adjust_gamma(image: np.ndarray, gamma: float = 1.2) -> np.ndarray:
     """
     Adjust the gamma of the image.
 
+    Works on a single image or a whole batch stacked into one array.
+
     Args:
-        image (np.ndarray): The original image.
+        image (np.ndarray): The original image or batch of images.
         gamma (float, optional): The gamma value to adjust the image. Defaults to 1.2.
 
     Returns:
         np.ndarray: The image with adjusted gamma.
     """
-    # Build a lookup table mapping the pixel values [0, 255] to their adjusted gamma values
-    invGamma = 5 / gamma
-    table = np.array(
-        [((i / 255.0) ** invGamma) * 255 for i in np.arange(0, 256)]
-    ).astype("uint8")
+    table = gamma_table(gamma)
+    # Apply gamma correction, cv2.LUT handles single images, fancy indexing handles stacked batches
+    return cv2.LUT(image, table) if image.ndim <= 3 else table[image]
 
-    # Apply gamma correction for the image
-    return cv2.LUT(image, table)
 
+def erode(image: np.ndarray, size: int = 3, iterations: int = 4) -> np.ndarray:
+    """
+    Apply erosion to thin out bright details.
 
-def edge_detection(img: np.ndarray) -> np.ndarray:
+    Args:
+        image (np.ndarray): The original image.
+        size (int, optional): Width and height of the square kernel. Defaults to 3.
+        iterations (int, optional): Number of erosion passes. Defaults to 4.
+
+    Returns:
+        np.ndarray: The eroded image.
     """
-    Apply edge detection to the image.
+    return cv2.erode(image, square_kernel(size), iterations=iterations)
+
+
+def to_grayscale(image: np.ndarray) -> np.ndarray:
+    """
+    Convert an RGB image to grayscale.
+
+    Args:
+        image (np.ndarray): RGB image.
+
+    Returns:
+        np.ndarray: Single channel image.
+    """
+    return cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
+
+
+def bgr_to_rgb(image: np.ndarray) -> np.ndarray:
+    """
+    Convert an image loaded by OpenCV from BGR to RGB channel order.
+
+    Args:
+        image (np.ndarray): BGR image.
+
+    Returns:
+        np.ndarray: RGB image.
+    """
+    return cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+
+
+def find_contours(img: np.ndarray) -> list:
+    """
+    Find contours of edges in the image.
 
     Args:
         img (np.ndarray): The original image.
 
     Returns:
-        np.ndarray: The image with detected edges.
+        list: Contours found by Canny edge detection.
     """
     # Apply Gaussian blur to reduce noise
     img_blur = cv2.GaussianBlur(img, (29, 29), 1)
@@ -65,21 +142,157 @@ def edge_detection(img: np.ndarray) -> np.ndarray:
 
     # Find contours
     contours, _ = cv2.findContours(edges, cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE)
+    return contours
+
+
+def edge_detection(img: np.ndarray) -> np.ndarray:
+    """
+    Apply edge detection to the image.
+
+    Args:
+        img (np.ndarray): The original image.
+
+    Returns:
+        np.ndarray: The image with detected edges.
+    """
+    contours = find_contours(img)
 
     # Draw contours on the original image
     img_with_contours = cv2.drawContours(img.copy(), contours, -3, (0, 255, 0), 2)
-
-    # Display the image with contours using matplotlib
-    # plt.imshow(img_with_contours, cmap='gray')
-    # plt.show()
     return img_with_contours
 
 
+def find_odometer_roi(
+    img: np.ndarray, min_area: float = 0.002, max_area: float = 0.25, min_aspect: float = 1.8, max_aspect: float = 8.0
+) -> Optional[tuple]:
+    """
+    Find the bounding box of the most likely odometer display.
+
+    The odometer is a wide, bright rectangle, so contours are filtered by their share of the image area and by
+    width-to-height ratio. The largest remaining bounding box wins.
+
+    Args:
+        img (np.ndarray): RGB image.
+        min_area (float, optional): Minimal box area as a fraction of the image. Defaults to 0.002.
+        max_area (float, optional): Maximal box area as a fraction of the image. Defaults to 0.25.
+        min_aspect (float, optional): Minimal width to height ratio. Defaults to 1.8.
+        max_aspect (float, optional): Maximal width to height ratio. Defaults to 8.0.
+
+    Returns:
+        Optional[tuple]: Bounding box (x, y, width, height) or None if no region matches.
+    """
+    gray = cv2.cvtColor(img, cv2.COLOR_RGB2GRAY)
+    image_area = gray.shape[0] * gray.shape[1]
+
+    best_box, best_area = None, 0
+    for contour in find_contours(gray):
+        x, y, width, height = cv2.boundingRect(contour)
+        area = width * height
+        aspect = width / height if height else 0
+        if not (min_area <= area / image_area <= max_area and min_aspect <= aspect <= max_aspect):
+            continue
+        if area > best_area:
+            best_box, best_area = (x, y, width, height), area
+    return best_box
+
+
+def crop_to_roi(img: np.ndarray, padding: float = 0.15) -> np.ndarray:
+    """
+    Crop the image to the odometer display, falling back to the full frame.
+
+    Args:
+        img (np.ndarray): RGB image.
+        padding (float, optional): Margin added around the box as a fraction of its size. Defaults to 0.15.
+
+    Returns:
+        np.ndarray: Cropped view of the image, or the original image when no region is found.
+    """
+    box = find_odometer_roi(img)
+    if box is None:
+        return img
+
+    x, y, width, height = box
+    pad_x, pad_y = int(width * padding), int(height * padding)
+    top, bottom = max(y - pad_y, 0), min(y + height + pad_y, img.shape[0])
+    left, right = max(x - pad_x, 0), min(x + width + pad_x, img.shape[1])
+    return img[top:bottom, left:right]
+
+
+STAGES = {
+    "bgr_to_rgb": bgr_to_rgb,
+    "grayscale": to_grayscale,
+    "gamma": adjust_gamma,
+    "erode": erode,
+    "edges": edge_detection,
+    "sharpen": unsharp_mask,
+}
+
+# Stages that map every pixel independently and can process a stacked batch in one call
+BATCH_STAGES = {"gamma"}
+
+
+def build_pipeline(recipe: Sequence) -> Callable[[np.ndarray], np.ndarray]:
+    """
+    Compose preprocessing stages into a single function.
+
+    Args:
+        recipe (Sequence): Pairs of stage name from STAGES and a dict of its parameters.
+
+    Returns:
+        Callable[[np.ndarray], np.ndarray]: Function applying all stages in order to one image.
+    """
+    steps = [partial(STAGES[name], **params) for name, params in recipe]
+
+    def pipeline(img: np.ndarray) -> np.ndarray:
+        for step in steps:
+            img = step(img)
+        return img
+
+    return pipeline
+
+
+@lru_cache(maxsize=None)
+def recipe_pipeline(name: str) -> Callable[[np.ndarray], np.ndarray]:
+    """
+    Return pipeline for a recipe from settings, built once per process.
+
+    Args:
+        name (str): Key of PREPROCESSING_RECIPES.
+
+    Returns:
+        Callable[[np.ndarray], np.ndarray]: Function applying the recipe to one image.
+    """
+    return build_pipeline(PREPROCESSING_RECIPES[name])
+
+
+def preprocess_batch(images, recipe: Sequence) -> list:
+    """
+    Apply preprocessing recipe to many images.
+
+    Pixel-wise stages process a stacked batch array in a single call, other stages run per image.
+
+    Args:
+        images (np.ndarray | Sequence[np.ndarray]): Batch array of equally sized images or a list of images.
+        recipe (Sequence): Pairs of stage name from STAGES and a dict of its parameters.
+
+    Returns:
+        list: Preprocessed images in input order.
+    """
+    for name, params in recipe:
+        stage = partial(STAGES[name], **params)
+        if name in BATCH_STAGES and isinstance(images, np.ndarray):
+            images = stage(images)
+        else:
+            images = [stage(img) for img in images]
+    return list(images)
+
+
 def preprocess(img: np.ndarray) -> np.ndarray:
     """
     Preprocesses an image for further analysis.
 
     The function takes an image as a numpy array, converts the color from BGR to RGB, adjusts the gamma, applies erosion, detects edges, and applies an unsharp mask for sharpening.
+    Display intermediate results in a notebook if needed, the function itself stays headless.
 
     Args:
         img (np.ndarray): The image to be preprocessed.
@@ -87,29 +300,4 @@ def preprocess(img: np.ndarray) -> np.ndarray:
     Returns:
         np.ndarray: The preprocessed image as a numpy array.
     """
-    img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-    gamma_corrected_img = adjust_gamma(
-        img, gamma=1.2
-    )  # You can adjust the gamma value depending on your image
-    kernel = np.ones((3, 3), np.uint8)
-    eroded_img = cv2.erode(gamma_corrected_img, kernel, iterations=4)
-    edge_img = edge_detection(eroded_img)
-    sharpened_img = unsharp_mask(edge_img)
-
-    print("Original image:")
-    plt.imshow(img, cmap="gray")
-    plt.show()
-    # print("Gamma corrected image:") # Uncomment to display the gamma corrected image
-    # plt.imshow(gamma_corrected_img, cmap='gray') # Uncomment to display the gamma corrected image
-    # plt.show() # Uncomment to display the gamma corrected image
-    # print("Eroded image:") # Uncomment to display the eroded image
-    # plt.imshow(eroded_img, cmap='gray') # Uncomment to display the eroded image
-    # plt.show() # Uncomment to display the eroded image
-    # print("Edge detected image:") # Uncomment to display the edge detected image
-    # plt.imshow(edge_img, cmap='gray') # Uncomment to display the edge detected image
-    # plt.show() # Uncomment to display the edge detected image
-    print("Sharpened image:")
-    plt.imshow(sharpened_img, cmap="gray")
-    plt.show()
-
-    return sharpened_img
+    return build_pipeline(LEGACY_RECIPE)(img)
@@ -0,0 +1,93 @@
+# Rebuild mileage database from training dataset without UI
+import os
+
+import numpy as np
+import pandas as pd
+from sklearn.cluster import KMeans
+
+import modules.charts as charts
+from modules.schema import storage_frame
+from modules.settings import JSON_FILE, STORAGE_BACKEND, TRAINING_JSON
+from modules.storage import get_store
+
+
+def load_training_data(source=TRAINING_JSON):
+    """Load training records sorted by date, empty dataframe if there are none."""
+    return charts.read_and_format_json(source)
+
+
+def truck_trend(df):
+    """Trend of truck vehicles mileage, empty dataframe if there are no trucks."""
+    truck_df = charts.filter_by_car(df, car_type="Dostawczy")
+    if truck_df.empty:
+        return pd.DataFrame()
+    return charts.predict_trend(truck_df)
+
+
+def cluster_by_distance_from_trend(df):
+    """Divide dataframe into clusters based on distance from trend."""
+    distance_from_trend = np.abs(df["Mileage"] - df["trend"]).values.reshape(-1, 1)
+    kmeans = KMeans(n_clusters=2, random_state=0)
+    cluster_labels = kmeans.fit_predict(distance_from_trend)
+    df["group"] = cluster_labels
+    return df
+
+
+def identify_car(df, clustered_df):
+    """Identify car subtypes based on clustering results."""
+    df["Car"] = "Scudo"
+
+    cluster = clustered_df["group"]
+    l4h2 = clustered_df[cluster == 0].index
+    l3h2 = clustered_df[cluster == 1].index
+
+    df.loc[l4h2, "Car"] = "L4H2"
+    df.loc[l3h2, "Car"] = "L3H2"
+
+    return df
+
+
+def count_cars(df_classified):
+    """Number of records per identified vehicle."""
+    car_name = df_classified["Car"]
+    return {
+        "Scudo": int((df_classified["Car type"] == "Osobowy").sum()),
+        "L3H2": int((car_name == "L3H2").sum()),
+        "L4H2": int((car_name == "L4H2").sum()),
+    }
+
+
+def save_data_to_json(df, target_file=JSON_FILE):
+    """Save processed data to JSON file, raises OSError or ValueError on failure."""
+    folder = os.path.dirname(target_file)
+    if folder:
+        os.makedirs(folder, exist_ok=True)
+    storage_frame(df).to_json(target_file, orient="records", indent=2)
+
+
+def save_to_database(df):
+    """Replace all records in configured storage with processed data, return number of records stored."""
+    return get_store().replace_all(storage_frame(df).to_dict("records"))
+
+
+def rebuild_database(source=TRAINING_JSON, target_file=None) -> dict:
+    """Classify training records into vehicles and save them in configured storage or target JSON file.
+
+    Returns summary with number of records per vehicle and "saved" flag, nothing is saved without truck records.
+    """
+    df = load_training_data(source)
+    if df.empty:
+        return {"records": 0, "saved": False, "reason": "no training data"}
+
+    truck_df_with_trend = truck_trend(df)
+    if truck_df_with_trend.empty:
+        return {"records": len(df), "saved": False, "reason": "no truck vehicles"}
+
+    df_clustered = cluster_by_distance_from_trend(truck_df_with_trend)
+    df_classified = identify_car(df, df_clustered)
+    if target_file:
+        save_data_to_json(df_classified, target_file)
+        stored = len(df_classified)
+    else:
+        stored = save_to_database(df_classified)
+    return {"records": stored, "saved": True, "target": target_file or STORAGE_BACKEND, **count_cars(df_classified)}
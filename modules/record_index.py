@@ -0,0 +1,90 @@
+# In-memory indexes of mileage records for duplicate lookups, note merging and per-car history
+import bisect
+
+
+def merge_notes(existing_note, new_note):
+    """Notes of a record saved again: both joined by a new line, or whichever is not empty."""
+    if existing_note and new_note:
+        return f"{existing_note}\n{new_note}"
+    return new_note or existing_note
+
+
+def record_key(record):
+    """Records are duplicates when they have the same date, car and mileage."""
+    return record["Date"], record["Car"], record["Mileage"]
+
+
+def time_key(record):
+    return record["Date"], record["Time"]
+
+
+class RecordIndex:
+    """Records in save order with hash indexes on (Date, Car, Mileage) and (Date, Time).
+
+    history holds (Date, Mileage) of each car sorted by date for bisect range lookups. Dates are
+    "YYYY-MM-DD" text, so text order is date order.
+    """
+
+    def __init__(self, records=()):
+        self.records = []
+        self.by_key = {}  # (Date, Car, Mileage): position of first such record
+        self.by_time = {}  # (Date, Time): position of first record taken at that time
+        self.history = {}  # Car: sorted [(Date, Mileage)]
+        for record in records:
+            self.add(record)
+
+    def __len__(self):
+        return len(self.records)
+
+    def find(self, record):
+        """Position of record with same date, car and mileage or None."""
+        return self.by_key.get(record_key(record))
+
+    def at_time(self, date, time):
+        """Position of record taken at date and time or None."""
+        return self.by_time.get((date, time))
+
+    def add(self, record):
+        """Append record even if a duplicate exists, return its position."""
+        position = len(self.records)
+        self.records.append(record)
+        self.by_key.setdefault(record_key(record), position)
+        self.by_time.setdefault(time_key(record), position)
+        bisect.insort(self.history.setdefault(record["Car"], []), (record["Date"], record["Mileage"]))
+        return position
+
+    def put(self, record):
+        """Add record or replace the one with same date, car and mileage in place. Return True if added."""
+        position = self.find(record)
+        if position is None:
+            self.add(record)
+            return True
+
+        old_time = time_key(self.records[position])
+        if self.by_time.get(old_time) == position:
+            del self.by_time[old_time]
+        self.by_time.setdefault(time_key(record), position)
+        self.records[position] = record
+        return False
+
+    def upsert(self, record):
+        """Add record or merge its notes into the one with same date, car and mileage.
+
+        Returns the stored record and True if it was added.
+        """
+        position = self.find(record)
+        if position is None:
+            self.add(record)
+            return record, True
+
+        existing = self.records[position]
+        merged = {**existing, "Notes": merge_notes(existing["Notes"], record["Notes"])}
+        self.records[position] = merged
+        return merged, False
+
+    def car_history(self, car, start=None, end=None):
+        """(Date, Mileage) of car between start and end dates inclusive, sorted by date."""
+        history = self.history.get(car, [])
+        low = 0 if start is None else bisect.bisect_left(history, (start,))
+        high = len(history) if end is None else bisect.bisect_right(history, (end, float("inf")))
+        return history[low:high]
@@ -0,0 +1,104 @@
+# Typed in-memory schema of mileage records shared by storage, charts and trends
+import logging
+
+import numpy as np
+import pandas as pd
+
+SCHEMA_VERSION = 1  # Part of cache and snapshot keys, bump when dtypes or derived columns change
+STORED_COLUMNS = ["Filename", "Date", "Time", "Mileage", "Car type", "Car", "Notes"]
+REQUIRED_COLUMNS = ["Date", "Mileage"]
+CATEGORY_COLUMNS = ["Car type", "Car", "Notes"]  # Few distinct values repeated in every record
+UNIX_EPOCH_ORDINAL = 719163  # date(1970, 1, 1).toordinal()
+MILEAGE_LIMIT = np.iinfo(np.int32).max
+MILEAGE_NOISE = r"[\[\]'\"\s]"  # Brackets, quotes and spaces around mileage written by old versions
+
+logger = logging.getLogger(__name__)
+
+
+class SchemaError(ValueError):
+    """Records miss columns required by the schema."""
+
+
+def to_records_frame(df, source="records"):
+    """Validated records with compact dtypes sorted by time of reading.
+
+    Date and Timestamp are datetime64, Time is "HH:MM" text, Mileage int32, car columns and notes categorical
+    and Day the date ordinal used by trend models. Rows with unreadable date or mileage are dropped.
+    """
+    if df.empty and df.columns.empty:
+        df = pd.DataFrame(columns=STORED_COLUMNS)
+    missing = [column for column in REQUIRED_COLUMNS if column not in df.columns]
+    if missing:
+        raise SchemaError(f"{source} miss columns: {', '.join(missing)}")
+
+    date = pd.to_datetime(df["Date"], errors="coerce").dt.normalize()
+    mileage = parse_mileage(df["Mileage"])
+    valid = date.notna() & mileage.between(0, MILEAGE_LIMIT)
+    if not valid.all():
+        logger.warning("Skipped %d invalid %s, rows: %s", (~valid).sum(), source, df.index[~valid].tolist()[:10])
+        df, date, mileage = df[valid], date[valid], mileage[valid]
+
+    if "Time" in df.columns:
+        time = parse_time(df["Time"])
+    else:
+        time = pd.Series(pd.NaT, index=df.index, dtype="timedelta64[ns]")
+    timestamp = date + time.fillna(pd.Timedelta(0))
+
+    records = pd.DataFrame(
+        {
+            "Filename": df["Filename"] if "Filename" in df.columns else None,
+            "Date": date,
+            "Time": timestamp.dt.strftime("%H:%M").where(time.notna(), "").astype("category"),
+            "Mileage": mileage.astype(np.int32),
+            **{column: category_column(df, column) for column in CATEGORY_COLUMNS},
+            "Timestamp": timestamp,
+            "Day": day_ordinal(date),
+        },
+        index=df.index,
+    )
+    return records.sort_values("Timestamp", kind="stable").reset_index(drop=True)
+
+
+def parse_mileage(values):
+    """Mileage as numbers, also from text like "['123456']" left by old versions, NaN if unreadable."""
+    if pd.api.types.is_numeric_dtype(values):
+        return pd.to_numeric(values, errors="coerce")
+    cleaned = values.astype(str).str.replace(MILEAGE_NOISE, "", regex=True)
+    return pd.to_numeric(cleaned, errors="coerce")
+
+
+def mileage_value(value):
+    """Mileage of one record as int by the same rule as parse_mileage, ValueError if unreadable."""
+    mileage = parse_mileage(pd.Series([value], dtype=object)).iloc[0]
+    if pd.isna(mileage) or not 0 <= mileage <= MILEAGE_LIMIT:
+        raise ValueError(f"Unreadable mileage: {value!r}")
+    return int(mileage)
+
+
+def parse_time(values):
+    """Time of day as timedelta from "HH:MM:SS" or "HH:MM" text, NaT if missing or unreadable."""
+    text = values.astype(str).str.strip().where(values.notna(), "")
+    text = text.where(text.str.count(":") != 1, text + ":00")
+    return pd.to_timedelta(text.where(text != ""), errors="coerce")
+
+
+def category_column(df, column):
+    if column not in df.columns:
+        return pd.Categorical([""] * len(df))
+    return df[column].fillna("").astype(str).astype("category")
+
+
+def day_ordinal(dates):
+    """Proleptic Gregorian ordinal of each date, same as pd.Timestamp.toordinal but vectorized."""
+    days = dates.to_numpy(dtype="datetime64[D]").astype(np.int64)
+    return pd.Series(days + UNIX_EPOCH_ORDINAL, index=dates.index, dtype=np.int32)
+
+
+def storage_frame(df):
+    """Stored columns of typed records with date and time as text, ready for JSON or a store."""
+    stored = df[[column for column in STORED_COLUMNS if column in df.columns]].copy()
+    stored["Date"] = pd.to_datetime(stored["Date"]).dt.strftime("%Y-%m-%d")
+    for column in stored.columns:
+        if isinstance(stored[column].dtype, pd.CategoricalDtype):
+            stored[column] = stored[column].astype(object)
+    return stored
@@ -1,14 +1,66 @@
 # Binary classification model path
 MODEL_PATH = "data\\recognition-model\\detect_car.pth"
+MODEL_ARCHITECTURE = "original"  # "original" or "compact", see COMPACT_MODEL_PATH
+COMPACT_MODEL_PATH = "data\\recognition-model\\detect_car_compact.pth"
+DISTILLATION_HOLDOUT = 0.2  # Share of training images left out of distillation to evaluate the compact model
+DISTILLATION_SEED = 0  # Seed of the split between distillation and held-out images
+MODEL_QUANTIZED = False  # Use int8 dynamic quantization of linear layers in original architecture
+QUANTIZED_MODEL_PATH = "data\\recognition-model\\detect_car_int8.pth"
+TORCHSCRIPT_MODEL_PATH = "data\\recognition-model\\detect_car.pt"
+ONNX_MODEL_PATH = "data\\recognition-model\\detect_car.onnx"
+INFERENCE_BACKEND = "torch"  # "torch", "torchscript" or "onnx", exported models need export command first
+TORCH_NUM_THREADS = None  # CPU threads for model inference, None keeps torch default
+CLASSIFIER_BATCH_SIZE = 16
+CLASSIFIER_WORKERS = 4  # Threads decoding images for batched classification
 
 # Data storage paths
 JSON_FILE = "modules\\data\\mileage.json"
+DATABASE_FILE = "modules\\data\\mileage.db"  # SQLite database, created from JSON_FILE on first use
+RECORD_LOG = "modules\\data\\mileage.jsonl"  # Saves appended since last compaction into JSON_FILE
+LOG_COMPACT_AFTER = 500  # Log lines before background compaction
+DATABASE_SNAPSHOT = "modules\\data\\mileage.parquet"  # Typed copy of records for fast reads, needs pyarrow
+STORAGE_BACKEND = "sqlite"  # "sqlite", "jsonl" (JSON_FILE with append-only log) or "json"
+GROUP_COMMIT_MAX_RECORDS = 100  # Saves from concurrent sessions stored with one commit
 
 # Training dataset paths
 TRAINING_DATASET = "data\\training-dataset"
 TRAINING_JSON = "modules\\data\\training_dataset.json"
+TRAINING_MANIFEST = "modules\\data\\training_manifest.json"  # Processed files with size, mtime, hash and status
 MULTI_READ = "data\\training-set\\multi_read"
 UNREADABLE = "data\\training-set\\unreadable"
+TRAINING_EXECUTION = "batch"  # "batch" or "pipeline"
+TRAINING_WORKERS = 1  # Worker processes in batch execution, each loads its own OCR and car type model
+PIPELINE_WORKERS = {"decode": 2, "ocr": 2, "classify": 1, "validate": 1}  # Threads per stage in pipeline execution
+PIPELINE_QUEUE_SIZE = 4  # Images waiting between two pipeline stages
+
+# OCR configuration
+OCR_LANGUAGES = ["en"]
+OCR_DEVICE = "auto"  # "auto", "cpu" or "gpu"
+OCR_BATCH_SIZE = 8
+OCR_CROP_ROI = True  # Crop image to odometer display before OCR
+OCR_PREPROCESSING = "none"  # Recipe name from PREPROCESSING_RECIPES applied after cropping
+OCR_AMBIGUITY_RATIO = 0.8  # Runner-up reading scoring above this share of the best one needs manual review
+
+# Data extraction
+EXTRACTION_WORKERS = 4  # Threads running OCR and classification, 2 per image processed at once
+STREAMING_EXTRACTION = False  # Show car type in the form before OCR finishes
+
+# Image preprocessing recipes: ordered (stage, parameters) pairs, see STAGES in preprocessing.py
+PREPROCESSING_RECIPES = {
+    "none": [],
+    "gamma": [("gamma", {"gamma": 1.2})],
+    "grayscale_gamma": [("grayscale", {}), ("gamma", {"gamma": 1.2})],
+    "legacy": [  # preprocess() adds bgr_to_rgb first for images read by OpenCV, OCR gets RGB already
+        ("gamma", {"gamma": 1.2}),
+        ("erode", {"size": 3, "iterations": 4}),
+        ("edges", {}),
+        ("sharpen", {"sigma": 16.0, "strength": 4.5}),
+    ],
+}
+
+# Extraction results cache
+EXTRACTION_CACHE_DIR = "modules\\data\\extraction-cache"
+EXTRACTION_CACHE_MAX_ENTRIES = 5000
 
 # Model output types
 CAR_TYPES = {0: "Dostawczy", 1: "Osobowy"}
@@ -0,0 +1,553 @@
+# Mileage database kept in a JSON file, a JSON file with append-only log or in SQLite
+import argparse
+import json
+import logging
+import os
+import sqlite3
+import threading
+from contextlib import closing
+
+import pandas as pd
+
+from modules.record_index import RecordIndex
+from modules.schema import SCHEMA_VERSION, mileage_value, to_records_frame
+from modules.settings import (
+    DATABASE_FILE,
+    DATABASE_SNAPSHOT,
+    JSON_FILE,
+    LOG_COMPACT_AFTER,
+    RECORD_LOG,
+    STORAGE_BACKEND,
+)
+
+COLUMNS = {  # Record field: SQLite column
+    "Filename": "filename",
+    "Date": "date",
+    "Time": "time",
+    "Mileage": "mileage",
+    "Car type": "car_type",
+    "Car": "car",
+    "Notes": "notes",
+}
+
+SNAPSHOT_VERSION_KEY = b"store_version"
+
+_store = None
+_store_lock = threading.Lock()
+_frames = {}  # Source: (version, DataFrame)
+_frames_lock = threading.Lock()
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_record(record):
+    """Record with all fields, mileage as int and text fields as str, e.g. from a DataFrame row.
+
+    Raises KeyError or ValueError if date or mileage is missing or unreadable.
+    """
+    return {
+        "Filename": field(record, "Filename", None),
+        "Date": str(record["Date"]),
+        "Time": field(record, "Time"),
+        "Mileage": mileage_value(record["Mileage"]),
+        "Car type": field(record, "Car type", None),
+        "Car": field(record, "Car"),
+        "Notes": field(record, "Notes"),
+    }
+
+
+def readable_records(records, source="records"):
+    """Normalized records and the unreadable ones, which are skipped with a warning instead of failing a load."""
+    normalized, unreadable = [], []
+    for record in records:
+        try:
+            normalized.append(normalize_record(record))
+        except (KeyError, ValueError, TypeError, AttributeError):
+            unreadable.append(record)
+    if unreadable:
+        logger.warning("Skipped %d unreadable %s, e.g. %s", len(unreadable), source, unreadable[0])
+    return normalized, unreadable
+
+
+def field(record, name, default=""):
+    """Text value of record field, default if it is missing or NaN as in DataFrame rows."""
+    value = record.get(name)
+    return default if value is None or pd.isna(value) else str(value)
+
+
+class JsonStore:
+    """Records as a list in one JSON file, indexed in memory while the file is unchanged.
+
+    Duplicates are found in the index, but the whole file is still written on every save.
+    """
+
+    def __init__(self, path=JSON_FILE):
+        self.path = path
+        self.lock = threading.Lock()  # Saves from different browser sessions run on threads of one process
+        self.index = None
+        self.indexed_version = None
+        self.unreadable = []  # Records of the file left out of the index, written back unchanged
+
+    def load(self):
+        """Index normalized records of the file unless the index is up to date, caller holds the lock.
+
+        Records written by older versions, e.g. with mileage as text, then match new saves of the same reading.
+        """
+        version = self.version()
+        if self.index is None or version != self.indexed_version:
+            records, self.unreadable = readable_records(self.read_records(), f"records in {self.path}")
+            self.index = RecordIndex(records)
+            self.indexed_version = version
+
+    def read_df(self):
+        try:
+            return pd.read_json(self.path)
+        except:
+            return pd.DataFrame()
+
+    def read_records(self):
+        try:
+            with open(self.path, "r") as file:
+                return json.load(file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return []
+
+    def write_records(self, records):
+        write_json_atomic(self.path, records)
+
+    def add(self, record):
+        """Append record or merge its notes into the one with same date, car and mileage. Return True if added."""
+        return self.add_many([record])[0]
+
+    def add_many(self, records):
+        """Save records with a single file write, return for each whether it was added."""
+        records = [normalize_record(record) for record in records]
+        with self.lock:
+            self.load()
+            try:
+                added = [self.index.upsert(record)[1] for record in records]
+                self.write_records(self.index.records + self.unreadable)
+            except:
+                self.index = None  # Upserts not written to the file, reload it on next use
+                raise
+            self.indexed_version = self.version()
+        return added
+
+    def replace_all(self, records):
+        """Replace database with records, duplicates merged like on save. Return number of records stored."""
+        index = indexed(records)
+        with self.lock:
+            self.write_records(index.records)
+            self.index, self.indexed_version, self.unreadable = index, self.version(), []
+        return len(index)
+
+    def count(self):
+        with self.lock:
+            self.load()
+            return len(self.index)
+
+    def car_history(self, car, start=None, end=None):
+        """(Date, Mileage) of car between start and end dates inclusive, sorted by date."""
+        with self.lock:
+            self.load()
+            return self.index.car_history(car, start, end)
+
+    def version(self):
+        return file_version(self.path)
+
+
+def write_json_atomic(path, records):
+    """Write records to a temporary file, flush it to disk and rename it over path."""
+    make_parent_dir(path)
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "w") as file:
+        json.dump(records, file, indent=4)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temp_path, path)
+
+
+def make_parent_dir(path):
+    folder = os.path.dirname(path)
+    if folder:
+        os.makedirs(folder, exist_ok=True)
+
+
+def indexed(records):
+    """Index of normalized records with duplicates merged like on save, unreadable records are skipped."""
+    index = RecordIndex()
+    for record in readable_records(records)[0]:
+        index.upsert(record)
+    return index
+
+
+class SqliteStore:
+    """Records in SQLite (WAL mode) with a unique index on date, car and mileage, saves update a single row."""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS records (
+            id INTEGER PRIMARY KEY,
+            filename TEXT,
+            date TEXT NOT NULL,
+            time TEXT NOT NULL DEFAULT '',
+            mileage INTEGER NOT NULL,
+            car_type TEXT,
+            car TEXT NOT NULL DEFAULT '',
+            notes TEXT NOT NULL DEFAULT ''
+        );
+        CREATE UNIQUE INDEX IF NOT EXISTS records_date_car_mileage ON records (date, car, mileage);
+        CREATE INDEX IF NOT EXISTS records_car_date ON records (car, date);
+    """
+    UPSERT = """
+        INSERT INTO records (filename, date, time, mileage, car_type, car, notes)
+        VALUES (:Filename, :Date, :Time, :Mileage, :car_type, :Car, :Notes)
+        ON CONFLICT (date, car, mileage) DO UPDATE SET notes = CASE
+            WHEN excluded.notes = '' THEN notes
+            WHEN notes = '' THEN excluded.notes
+            ELSE notes || char(10) || excluded.notes
+        END
+    """  # Same result as merge_notes
+
+    def __init__(self, path=DATABASE_FILE):
+        self.path = path
+        make_parent_dir(path)
+        with closing(self.connect()) as connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.executescript(self.SCHEMA)
+
+    def connect(self):
+        """New connection in autocommit mode, transactions are opened explicitly.
+
+        synchronous=FULL syncs the WAL on every commit, with NORMAL a save reported as stored could be lost
+        on power failure.
+        """
+        connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        connection.execute("PRAGMA synchronous=FULL")
+        return connection
+
+    def read_df(self):
+        """All records ordered by date and time, Date parsed as datetime like pd.read_json does."""
+        selected = ", ".join(f'{column} AS "{field}"' for field, column in COLUMNS.items())
+        with closing(self.connect()) as connection:
+            df = pd.read_sql_query(f"SELECT {selected} FROM records ORDER BY date, time", connection)
+        if df.empty:
+            return pd.DataFrame()
+        df["Date"] = pd.to_datetime(df["Date"])
+        return df
+
+    def add(self, record):
+        """Insert record or merge its notes into the one with same date, car and mileage. Return True if added."""
+        return self.add_many([record])[0]
+
+    def add_many(self, records):
+        """Save records in a single transaction, return for each whether it was added."""
+        added = []
+        with closing(self.connect()) as connection:
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                for params in map(self.params, records):
+                    exists = connection.execute(
+                        "SELECT 1 FROM records WHERE date = :Date AND car = :Car AND mileage = :Mileage", params
+                    ).fetchone()
+                    connection.execute(self.UPSERT, params)
+                    added.append(exists is None)
+                connection.execute("COMMIT")
+            except:
+                connection.execute("ROLLBACK")
+                raise
+        return added
+
+    def replace_all(self, records):
+        """Replace all records in one transaction, return number of rows stored after merging duplicates."""
+        with closing(self.connect()) as connection:
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                connection.execute("DELETE FROM records")
+                connection.executemany(self.UPSERT, [self.params(record) for record in readable_records(records)[0]])
+                connection.execute("COMMIT")
+            except:
+                connection.execute("ROLLBACK")
+                raise
+        return self.count()
+
+    def count(self):
+        with closing(self.connect()) as connection:
+            return connection.execute("SELECT COUNT(*) FROM records").fetchone()[0]
+
+    def car_history(self, car, start=None, end=None):
+        """(Date, Mileage) of car between start and end dates inclusive, sorted by date, from the (car, date) index."""
+        query = "SELECT date, mileage FROM records WHERE car = ? AND date BETWEEN ? AND ? ORDER BY date, mileage"
+        with closing(self.connect()) as connection:
+            return connection.execute(query, (car, start or "", end or "\uffff")).fetchall()
+
+    def version(self):
+        """Changes with every commit, which writes to the WAL file or, after a checkpoint, to the database."""
+        return file_version(self.path, f"{self.path}-wal")
+
+    @staticmethod
+    def params(record):
+        params = normalize_record(record)
+        params["car_type"] = params.pop("Car type")  # Named parameters can't contain spaces
+        return params
+
+
+class JsonlStore:
+    """Compacted JSON snapshot plus an append-only JSON Lines log, a save appends one line.
+
+    Each log line holds the full record after merging notes, so replaying a line twice gives the same result
+    and a crash at any point of compaction loses nothing. Records are kept in a RecordIndex, reloaded when
+    another process changed the files.
+    """
+
+    def __init__(self, snapshot=JSON_FILE, log=RECORD_LOG, compact_after=LOG_COMPACT_AFTER):
+        self.snapshot = snapshot
+        self.log = log
+        self.rotated_log = f"{log}.old"  # Log being compacted, new lines already go to a fresh log
+        self.compact_after = compact_after
+        self.lock = threading.Lock()
+        self.index = None
+        self.unreadable = []  # Snapshot records left out of the index, kept by compaction
+        self.log_lines = 0
+        self.signature = None
+        self.compaction = None
+
+    def version(self):
+        return file_version(self.snapshot, self.rotated_log, self.log)
+
+    def load(self):
+        """Replay logs over snapshot unless records in memory are up to date, caller holds the lock."""
+        signature = self.version()
+        if self.index is not None and signature == self.signature:
+            return
+
+        self.index = RecordIndex()
+        snapshot = JsonStore(self.snapshot).read_records()
+        records, self.unreadable = readable_records(snapshot, f"records in {self.snapshot}")
+        for record in records:
+            self.index.put(record)
+        for path in (self.rotated_log, self.log):
+            lines = read_log(path)
+            for record in readable_records(lines, f"records in {path}")[0]:
+                self.index.put(record)
+        self.log_lines = len(lines)  # Lines of the rotated log are already being compacted
+        self.signature = self.version()
+
+    def read_df(self):
+        """All records, Date parsed as datetime like pd.read_json does."""
+        with self.lock:
+            self.load()
+            records = list(self.index.records)
+        if not records:
+            return pd.DataFrame()
+        df = pd.DataFrame(records)
+        df["Date"] = pd.to_datetime(df["Date"])
+        return df
+
+    def add(self, record):
+        """Append record, with notes merged into the one with same date, car and mileage. Return True if added."""
+        return self.add_many([record])[0]
+
+    def add_many(self, records):
+        """Append records to the log with a single write and fsync, return for each whether it was added."""
+        records = [normalize_record(record) for record in records]
+        with self.lock:
+            self.load()
+            try:
+                saved = [self.index.upsert(record) for record in records]
+                append_lines(self.log, [record for record, _ in saved])
+            except:
+                self.index = None  # Upserts not written to the log, reload snapshot and log on next use
+                raise
+            self.log_lines += len(saved)
+            self.signature = self.version()
+            if self.log_lines >= self.compact_after:
+                self.start_compaction()
+        return [added for _, added in saved]
+
+    def start_compaction(self):
+        """Compact on a background thread unless one is running, caller holds the lock."""
+        if self.compaction and self.compaction.is_alive():
+            return
+        self.compaction = threading.Thread(target=self.compact, name="record-log-compaction", daemon=True)
+        self.compaction.start()
+
+    def compact(self):
+        """Write all records to snapshot and drop log lines already contained in it."""
+        with self.lock:
+            self.load()
+            if not os.path.exists(self.rotated_log) and os.path.exists(self.log):
+                os.replace(self.log, self.rotated_log)
+                self.signature = self.version()  # Saves during the snapshot write must not reload everything
+            records = self.index.records + self.unreadable
+            self.log_lines = 0
+
+        write_json_atomic(self.snapshot, records)  # Saves continue meanwhile, appending to the fresh log
+
+        with self.lock:
+            remove_file(self.rotated_log)
+            self.signature = self.version()
+
+    def replace_all(self, records):
+        """Replace all records, duplicates merged like on save. Return number of records stored."""
+        index = indexed(records)
+        with self.lock:
+            self.index, self.unreadable = index, []
+            write_json_atomic(self.snapshot, index.records)
+            remove_file(self.rotated_log)
+            remove_file(self.log)
+            self.log_lines = 0
+            self.signature = self.version()
+            return len(index)
+
+    def count(self):
+        with self.lock:
+            self.load()
+            return len(self.index)
+
+    def car_history(self, car, start=None, end=None):
+        """(Date, Mileage) of car between start and end dates inclusive, sorted by date."""
+        with self.lock:
+            self.load()
+            return self.index.car_history(car, start, end)
+
+
+def append_lines(path, records):
+    """Append records as JSON lines and flush them to disk before returning."""
+    lines = "".join(json.dumps(record, ensure_ascii=False) + "\n" for record in records)
+    with open(path, "a", encoding="utf-8") as file:
+        file.write(lines)
+        file.flush()
+        os.fsync(file.fileno())
+
+
+def read_log(path):
+    """Records from JSON Lines log, a line torn by a crash during append is cut off."""
+    try:
+        with open(path, "rb") as file:
+            data = file.read()
+    except FileNotFoundError:
+        return []
+
+    complete = data.rfind(b"\n") + 1
+    if complete < len(data):
+        with open(path, "r+b") as file:
+            file.truncate(complete)
+    return [json.loads(line) for line in data[:complete].splitlines() if line.strip()]
+
+
+def file_version(*paths):
+    """Size and modification time of each file, None for missing ones."""
+    version = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+            version.append([stat.st_size, stat.st_mtime_ns])
+        except FileNotFoundError:
+            version.append(None)
+    return version
+
+
+def remove_file(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+STORES = {"json": JsonStore, "jsonl": JsonlStore, "sqlite": SqliteStore}
+
+
+def get_store():
+    """Return process-wide store selected in settings, migrating JSON database into a new SQLite file."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            new_database = STORAGE_BACKEND == "sqlite" and not os.path.exists(DATABASE_FILE)
+            _store = STORES[STORAGE_BACKEND]()
+            if new_database:
+                migrate_from_json(_store)
+    return _store
+
+
+def cached_frame(source, version, load):
+    """DataFrame from load() reused while version of source stays the same. Returns a copy callers may modify."""
+    with _frames_lock:
+        entry = _frames.get(source)
+    if entry is None or entry[0] != version:
+        entry = (version, load())
+        with _frames_lock:
+            _frames[source] = entry
+    return entry[1].copy()
+
+
+def database_version():
+    """Changes whenever records of configured store or their schema change."""
+    return [STORAGE_BACKEND, SCHEMA_VERSION, get_store().version()]
+
+
+def read_database_df():
+    """Typed records of configured store, from memory or Parquet snapshot while the store is unchanged."""
+    version = database_version()
+    return cached_frame("database", version, lambda: load_with_snapshot(get_store(), version))
+
+
+def load_with_snapshot(store, version, path=DATABASE_SNAPSHOT):
+    """Read typed records through Parquet snapshot of the store, rewriting the snapshot if it is missing or outdated."""
+    df = read_snapshot(path, version)
+    if df is None:
+        df = to_records_frame(store.read_df(), "database records")
+        write_snapshot(df, path, version)
+    return df
+
+
+def read_snapshot(path, version):
+    """Records from Parquet snapshot written at store version, None without pyarrow or snapshot."""
+    try:
+        import pyarrow.parquet as pq
+
+        metadata = pq.read_schema(path).metadata or {}
+        if metadata.get(SNAPSHOT_VERSION_KEY) != json.dumps(version).encode():
+            return None
+        return pq.read_table(path).to_pandas()
+    except (ImportError, OSError, ValueError):
+        return None
+
+
+def write_snapshot(df, path, version):
+    """Save records as Parquet with store version in file metadata, skipped without pyarrow."""
+    if df.empty:
+        return
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        metadata = {**(table.schema.metadata or {}), SNAPSHOT_VERSION_KEY: json.dumps(version).encode()}
+        temp_path = f"{path}.tmp"
+        pq.write_table(table.replace_schema_metadata(metadata), temp_path)
+        os.replace(temp_path, path)
+    except (ImportError, OSError, ValueError, TypeError):
+        pass  # Values pyarrow can't store in a column only cost the snapshot, records are read from store
+
+
+def migrate_from_json(store, json_file=JSON_FILE) -> dict:
+    """Copy records from JSON database into an empty store, duplicates are merged like on save.
+
+    Records with unreadable date or mileage are skipped and counted, the JSON file is left unchanged.
+    """
+    if store.count():
+        return {"migrated": 0, "reason": "store is not empty"}
+
+    records, unreadable = readable_records(JsonStore(json_file).read_records(), f"records in {json_file}")
+    stored = store.replace_all(records) if records else 0
+    return {"migrated": len(records), "stored": stored, "skipped": len(unreadable)}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Mileage database utilities.")
+    parser.add_argument("command", choices=["migrate"], help="migrate: copy JSON database into empty SQLite database")
+    parser.add_argument("--json", default=JSON_FILE, help="JSON database to migrate")
+    args = parser.parse_args()
+
+    if args.command == "migrate":
+        print(migrate_from_json(SqliteStore(), args.json))
@@ -1,14 +1,32 @@
 import os
+import threading
 
 import pandas as pd
 import streamlit as st
 
 from modules.cars import Car
-from modules.data_processing import append_to_json, open_json_as_df
+from modules.data_processing import append_to_json
 from modules.docs_generator import generate_handover_protocol
 from modules.trends import predict_car
 
 
+def warm_up_models():
+    """Import and load OCR and car type models."""
+    import modules.inference as inference
+    import modules.ocr as ocr
+
+    ocr.get_reader()
+    inference.get_backend()
+
+
+@st.cache_resource(show_spinner=False)
+def start_warm_up():
+    """Start loading models in a background thread once per server process."""
+    thread = threading.Thread(target=warm_up_models, name="warm-up", daemon=True)
+    thread.start()
+    return thread
+
+
 def uploader():
     # if st.button("Camera"):
     #     return st.camera_input("Take a photo")
@@ -20,13 +38,13 @@ def car_form_prediction(mileage, date, car_type=None):
     """Pre-fill car form with predicted car type."""
     if mileage is None or date is None:
         return None
-    cars_data = open_json_as_df()
-    return predict_car(mileage, date, cars_data, car_type)
+    return predict_car(mileage, date, car_type=car_type)
 
 
 def confirmation_form(data=None):
     """Display editable form with pre-filled mileage and car type."""
-    mileage, car_type, date, time = data if data else (None, None, None, None)
+    candidates, car_type, date, time = data if data else ([], None, None, None)
+    mileage = candidates[0].value if candidates else None
 
     with st.form("Potwierdzenie danych", clear_on_submit=True, border=0):
         mileage = mileage_field(mileage)
@@ -38,17 +56,17 @@ def confirmation_form(data=None):
 
         col1, col2 = st.columns(2)
         with col1:
-            save_button(mileage, car.name, date, time, notes)
+            save_button(mileage, car, date, time, notes)
 
         with col2:
             print_protocol_button(mileage, car, date, time, notes)
 
 
-def save_button(mileage, car_type, date, time, notes):
+def save_button(mileage, car, date, time, notes):
     """Display save button."""
     submitted = st.form_submit_button("Zapisz")
     if submitted:
-        success = append_to_json(file_path=None, mileage=mileage, car=car_type, date=date, time=time, note=notes)
+        success = append_to_json(file_path=None, mileage=mileage, car=car, date=date, time=time, note=notes)
         if success:
             st.success("Zapisano dane")
             st.session_state.form_submitted = True
@@ -0,0 +1,392 @@
+# Extract data from the training dataset into training JSON in batches, on worker processes or as a streaming pipeline
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+
+import modules.inference as inference
+import modules.ocr as ocr
+from modules.data_processing import cache_extraction, cached_extraction, extract_data_batch
+from modules.date import read_datetime
+from modules.extraction_cache import image_key
+from modules.image import load_image
+from modules.ocr import best_mileage, is_ambiguous
+from modules.pipeline import Stage, run_pipeline
+from modules.record_index import RecordIndex
+from modules.settings import (
+    MULTI_READ,
+    OCR_BATCH_SIZE,
+    PIPELINE_QUEUE_SIZE,
+    PIPELINE_WORKERS,
+    TRAINING_DATASET,
+    TRAINING_EXECUTION,
+    TRAINING_JSON,
+    TRAINING_MANIFEST,
+    TRAINING_WORKERS,
+    UNREADABLE,
+)
+
+ERROR = "error"  # Status of images whose extraction raised, e.g. files PIL can't decode
+FAILED_STATUSES = {"unreadable", "multi_read", ERROR}
+FIRST_CHECKPOINT = 20  # Processed images before first save, later intervals double to keep total writes linear
+
+logger = logging.getLogger(__name__)
+
+
+def process_training_dataset(
+    workers=TRAINING_WORKERS, on_result=None, retry_failed=False, execution=TRAINING_EXECUTION
+) -> dict:
+    """Process new and changed training images with data extraction and error handling.
+
+    Images already recorded in the manifest are skipped, failed ones (unreadable, multi-read or raising an error
+    during extraction) too unless retry_failed.
+    execution is "batch" (OCR batches, on worker processes if workers > 1) or "pipeline" (threaded stages).
+    on_result(index, total, rel_path, extracted, status) is called for every processed image.
+    Returns number of images per status.
+    """
+    manifest = load_manifest()
+    files = list_dataset_files()
+    pending = files_to_process(files, manifest, retry_failed)
+    create_error_folders()
+
+    writer = TrainingWriter()
+    summary = {"skipped": len(files) - len(pending)}
+    last_checkpoint = 0
+    try:
+        results = extract_results(pending, workers, execution)
+        for index, (rel_path, extracted, special_case) in enumerate(results):
+            status = process_single_image(rel_path, extracted, special_case, writer)
+            manifest[rel_path] = manifest_entry(rel_path, status)
+            summary[status] = summary.get(status, 0) + 1
+            if on_result:
+                on_result(index, len(pending), rel_path, extracted, status)
+
+            processed = index + 1
+            if processed - last_checkpoint >= max(FIRST_CHECKPOINT, last_checkpoint):
+                checkpoint(writer, manifest)
+                last_checkpoint = processed
+    finally:
+        checkpoint(writer, manifest)  # Keeps progress of interrupted runs
+    return summary
+
+
+def checkpoint(writer, manifest):
+    """Save buffered records before the manifest, so manifest never lists files whose records were lost."""
+    writer.flush()
+    save_manifest(manifest)
+
+
+class TrainingWriter:
+    """Training JSON records held in memory for a whole run, indexed by (Date, Time) and saved on flush."""
+
+    def __init__(self):
+        self.index = RecordIndex(load_training_json())
+        self.unsaved = 0
+
+    def add(self, record):
+        """Buffer record unless one with the same date and time exists. Return True if added."""
+        if self.index.at_time(record["Date"], record["Time"]) is not None:
+            return False
+        self.index.add(record)
+        self.unsaved += 1
+        return True
+
+    def flush(self):
+        """Write all records if any were added since last flush."""
+        if self.unsaved:
+            save_training_json(self.index.records)
+            self.unsaved = 0
+
+
+def file_stat(rel_path):
+    """Size and modification time of a dataset file."""
+    stat = os.stat(os.path.join(TRAINING_DATASET, rel_path))
+    return stat.st_size, stat.st_mtime_ns
+
+
+def file_hash(rel_path):
+    """Content hash of a dataset file, same as extraction cache key."""
+    with open(os.path.join(TRAINING_DATASET, rel_path), "rb") as file:
+        return image_key(file.read())
+
+
+def manifest_entry(rel_path, status):
+    """Describe processed dataset file."""
+    size, mtime = file_stat(rel_path)
+    return {"size": size, "mtime": mtime, "hash": file_hash(rel_path), "status": status}
+
+
+def is_unchanged(rel_path, entry):
+    """Check if file content matches manifest entry, hashing only when size or mtime differ."""
+    size, mtime = file_stat(rel_path)
+    if (size, mtime) == (entry["size"], entry["mtime"]):
+        return True
+    if size != entry["size"] or file_hash(rel_path) != entry["hash"]:
+        return False
+    entry["mtime"] = mtime  # Touched but not modified
+    return True
+
+
+def files_to_process(files, manifest, retry_failed=False):
+    """Return files which are new, changed, or failed before when retrying."""
+    pending = []
+    for rel_path in files:
+        entry = manifest.get(rel_path)
+        if entry is None or not is_unchanged(rel_path, entry):
+            pending.append(rel_path)
+        elif retry_failed and entry["status"] in FAILED_STATUSES:
+            pending.append(rel_path)
+    return pending
+
+
+def load_manifest():
+    """Load manifest of processed dataset files or return empty dict."""
+    try:
+        with open(TRAINING_MANIFEST, "r") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def save_manifest(manifest):
+    """Atomically replace manifest file."""
+    os.makedirs(os.path.dirname(TRAINING_MANIFEST), exist_ok=True)
+    temp_path = f"{TRAINING_MANIFEST}.tmp"
+    with open(temp_path, "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(temp_path, TRAINING_MANIFEST)
+
+
+def extract_results(files, workers, execution):
+    """Yield (rel_path, extracted data, special case status or None) for each file.
+
+    Files whose extraction raised get the ERROR status with empty data, so one broken image doesn't stop the run.
+    """
+    if execution == "pipeline":
+        for job in run_pipeline(map(Job, files), pipeline_stages(), PIPELINE_QUEUE_SIZE):
+            if job.special_case == ERROR:
+                yield job.rel_path, failed_extraction(), ERROR
+            else:
+                yield job.rel_path, job.extracted(), job.special_case
+        return
+
+    for rel_path, extracted in zip(files, extract_files(files, workers)):
+        if extracted is None:
+            yield rel_path, failed_extraction(), ERROR
+        else:
+            yield rel_path, extracted, is_special_case(extracted[0], rel_path)
+
+
+def failed_extraction():
+    """Extracted data of an image that couldn't be processed: no mileage candidates, car type, date or time."""
+    return [[], None, None, None]
+
+
+class Job:
+    """One training image passing through pipeline stages."""
+
+    def __init__(self, rel_path):
+        self.rel_path = rel_path
+        self.image = None
+        self.date = self.time = None
+        self.candidates = self.car_type = None
+        self.from_cache = False
+        self.special_case = None
+
+    def extracted(self):
+        return [self.candidates, self.car_type, self.date, self.time]
+
+
+def guarded(stage):
+    """Pipeline stage skipping failed jobs, an exception marks the job failed instead of stopping the pipeline."""
+
+    def run(job):
+        if job.special_case == ERROR:
+            return job
+        try:
+            return stage(job)
+        except Exception as e:
+            logger.warning("Extraction of %s failed: %s: %s", job.rel_path, type(e).__name__, e)
+            job.special_case, job.image = ERROR, None
+            return job
+
+    return run
+
+
+def decode_stage(job):
+    """Read image, reuse cached extraction results or decode it for the next stages."""
+    job.image = load_image(os.path.join(TRAINING_DATASET, job.rel_path))
+    job.date, job.time = read_datetime(job.image.name)
+
+    cached = cached_extraction(job.image.data)
+    if cached:
+        job.candidates, job.car_type = cached
+        job.from_cache = True
+    else:
+        job.image.rgb, job.image.resized  # Decode here, so OCR and classifier threads only compute
+    return job
+
+
+def ocr_stage(job):
+    if not job.from_cache:
+        job.candidates = ocr.mileage_ocr(job.image)
+    return job
+
+
+def classify_stage(job):
+    if not job.from_cache:
+        job.car_type = inference.identify_car(job.image)
+        cache_extraction(job.image.data, job.candidates, job.car_type)
+    job.image = None  # Release decoded arrays before the job waits in the next queue
+    return job
+
+
+def validate_stage(job):
+    job.special_case = is_special_case(job.candidates, job.rel_path)
+    return job
+
+
+def pipeline_stages():
+    """Stages from decoding to validation with worker counts from settings, records are written by the consumer."""
+    return [
+        Stage("decode", guarded(decode_stage), PIPELINE_WORKERS["decode"]),
+        Stage("ocr", guarded(ocr_stage), PIPELINE_WORKERS["ocr"]),
+        Stage("classify", guarded(classify_stage), PIPELINE_WORKERS["classify"]),
+        Stage("validate", guarded(validate_stage), PIPELINE_WORKERS["validate"]),
+    ]
+
+
+def chunks(files, size=OCR_BATCH_SIZE):
+    """Split file list into consecutive chunks."""
+    return [files[start : start + size] for start in range(0, len(files), size)]
+
+
+def extract_chunk(rel_paths):
+    """Extract data from a chunk of training images, reading OCR in one batch.
+
+    If the batch fails, images are extracted one by one and those failing again give None.
+    """
+    paths = [os.path.join(TRAINING_DATASET, rel_path) for rel_path in rel_paths]
+    try:
+        return extract_data_batch(paths)
+    except Exception:
+        return [extract_single(path) for path in paths]
+
+
+def extract_single(path):
+    """Extracted data of one image or None if it can't be processed."""
+    try:
+        return extract_data_batch([path])[0]
+    except Exception as e:
+        logger.warning("Extraction of %s failed: %s: %s", path, type(e).__name__, e)
+        return None
+
+
+def init_worker(threads):
+    """Load OCR and car type models once per worker process and limit its CPU threads."""
+    import modules.detection_model as detection_model
+    import modules.inference as inference
+    import modules.ocr as ocr
+
+    detection_model.configure_threads(threads)
+    ocr.get_reader()
+    inference.get_backend()
+
+
+def extract_files(files, workers=TRAINING_WORKERS):
+    """Yield extracted data for each file in input order, using worker processes if workers > 1."""
+    if workers <= 1:
+        for chunk in chunks(files):
+            yield from extract_chunk(chunk)
+        return
+
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    context = multiprocessing.get_context("spawn")  # Forking a process with loaded torch threads is unsafe
+    with ProcessPoolExecutor(workers, mp_context=context, initializer=init_worker, initargs=(threads,)) as executor:
+        for results in executor.map(extract_chunk, chunks(files)):
+            yield from results
+
+
+def process_single_image(rel_path, extracted, special_case, writer):
+    """Store extraction results of one image file and return its status."""
+    if special_case:
+        return special_case
+
+    mileage, car_type, date, time = extracted
+    file_path = os.path.join(TRAINING_DATASET, rel_path)
+    return "saved" if process_valid_data(writer, file_path, date, time, mileage, car_type) else "duplicate"
+
+
+def is_special_case(mileage, rel_path):
+    """Handle unreadable and multi-read cases."""
+    if not mileage:
+        copy_to_error_folder(rel_path, UNREADABLE)
+        return "unreadable"
+
+    if is_ambiguous(mileage):
+        copy_to_error_folder(rel_path, MULTI_READ)
+        return "multi_read"
+
+    return None
+
+
+def copy_to_error_folder(rel_path, target_folder):
+    """Copy file to appropriate error folder."""
+    source = os.path.join(TRAINING_DATASET, rel_path)
+    target = os.path.join(target_folder, os.path.basename(rel_path))
+    shutil.copy(source, target)
+
+
+def process_valid_data(writer, file_path, date, time, mileage, car_type):
+    """Process data with valid mileage and car type. Return True if a new record was added."""
+    mileage = best_mileage(mileage)
+    record = {
+        "Filename": file_path,
+        "Date": str(date),
+        "Time": str(time),
+        "Mileage": mileage,
+        "Car type": car_type,
+        "Car": "",
+        "Notes": "Training Dataset",
+    }
+
+    return writer.add(record)
+
+
+def list_dataset_files():
+    """Get all image files recursively from the training dataset and its subdirectories."""
+    filenames = []
+
+    for root, _, files in os.walk(TRAINING_DATASET):
+        for file in files:
+            file_path = os.path.join(root, file)
+            if file_path.lower().endswith((".png", ".jpg", ".jpeg")):
+                rel_path = os.path.relpath(file_path, TRAINING_DATASET)
+                filenames.append(rel_path)
+    return filenames
+
+
+def load_training_json():
+    """Load training JSON file or return empty list."""
+    try:
+        with open(TRAINING_JSON, "r") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return []
+
+
+def save_training_json(data):
+    """Atomically replace training JSON file."""
+    os.makedirs(os.path.dirname(TRAINING_JSON), exist_ok=True)
+    temp_path = f"{TRAINING_JSON}.tmp"
+    with open(temp_path, "w") as f:
+        json.dump(data, f, indent=2)
+    os.replace(temp_path, TRAINING_JSON)
+
+
+def create_error_folders():
+    """Create folders for problem files if they don't exist."""
+    os.makedirs(UNREADABLE, exist_ok=True)
+    os.makedirs(MULTI_READ, exist_ok=True)
@@ -1,19 +1,59 @@
+import threading
+
+import numpy as np
 import pandas as pd
 from sklearn.neighbors import KNeighborsClassifier
 
+from modules.schema import day_ordinal
+from modules.storage import database_version, read_database_df
+
+NEIGHBORS = 3
+
+_predictors = {}  # Car type: (database version, fitted model or None)
+_predictors_lock = threading.Lock()
 
-def predict_car(mileage, date, df, car_type=None):
-    """Predict car model based on mileage and date"""
+
+def fit_predictor(df, car_type=None):
+    """Fit model predicting car from date and mileage of typed records, None if there are no records"""
     if car_type:
         df = df[df["Car type"] == car_type]
+    if df.empty:
+        return None
+
+    model = KNeighborsClassifier(n_neighbors=min(NEIGHBORS, len(df)))
+    model.fit(df[["Day", "Mileage"]].to_numpy(), df["Car"].astype(str).to_numpy())
+    return model
+
+
+def get_predictor(car_type=None):
+    """Fitted model for car type, fitted again only after the database changed"""
+    version = database_version()
+    with _predictors_lock:
+        cached = _predictors.get(car_type)
+    if cached and cached[0] == version:
+        return cached[1]
+
+    model = fit_predictor(read_database_df(), car_type)
+    with _predictors_lock:
+        _predictors[car_type] = (version, model)
+    return model
+
+
+def predict_with(model, mileages, dates):
+    """Predict car for each mileage and date pair, None for all without a model"""
+    if model is None:
+        return [None] * len(mileages)
+    days = day_ordinal(pd.Series(pd.to_datetime(list(dates))))
+    x = np.column_stack([days.to_numpy(), np.asarray(mileages, dtype=np.int64)])
+    return list(model.predict(x))
+
 
-    df = df.copy()
-    df["date_ordinal"] = df["Date"].map(pd.Timestamp.toordinal)
+def predict_cars(mileages, dates, car_type=None):
+    """Predict car models of many readings with the cached model of the mileage database"""
+    return predict_with(get_predictor(car_type), mileages, dates)
 
-    model = KNeighborsClassifier(n_neighbors=3)
-    x_train = df[["date_ordinal", "Mileage"]]
-    model.fit(x_train, df["Car"])
 
-    date_ordinal = pd.Timestamp(date).toordinal()
-    prediction = model.predict(pd.DataFrame([[date_ordinal, mileage]], columns=x_train.columns))
-    return prediction[0]
+def predict_car(mileage, date, df=None, car_type=None):
+    """Predict car model based on mileage and date, from typed records in df or the cached database model"""
+    model = get_predictor(car_type) if df is None else fit_predictor(df, car_type)
+    return predict_with(model, [mileage], [date])[0]
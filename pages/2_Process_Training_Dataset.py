@@ -1,85 +1,33 @@
-import json
 import os
-import shutil
 
 import streamlit as st
 
-from modules.data_processing import extract_data
-from modules.settings import MULTI_READ, TRAINING_DATASET, TRAINING_JSON, UNREADABLE
+from modules.settings import TRAINING_EXECUTION, TRAINING_JSON, TRAINING_WORKERS
+from modules.streamlit_functions import start_warm_up
+from modules.training_dataset import ERROR, list_dataset_files, load_training_json, process_training_dataset
 
 
-def process_training_dataset() -> None:
-    """Process all training images with data extraction and error handling."""
-    files = list_dataset_files()
-    create_error_folders()
-
+def run_processing(workers, retry_failed, execution):
+    """Process new and changed training images showing progress and results of each image."""
     progress_bar = st.progress(0)
-    total_files = len(files)
-
-    for index, rel_path in enumerate(files):
-        process_single_image(rel_path, index, total_files, progress_bar)
-
-
-def process_single_image(rel_path, index, total_files, progress_bar):
-    """Process one image file and update progress."""
-    file_path = os.path.join(TRAINING_DATASET, rel_path)
 
-    mileage, car_type, date, time = extract_data(file_path)
-    display_extraction_results(mileage, car_type, date, time)
+    def on_result(index, total_files, rel_path, extracted, status):
+        if status == ERROR:
+            st.warning(f"Could not process image: {rel_path}")
+        else:
+            display_extraction_results(*extracted)
+        update_progress(rel_path, index, total_files, progress_bar)
 
-    if not is_special_case(mileage, rel_path):
-        process_valid_data(file_path, date, time, mileage, car_type)
-
-    update_progress(rel_path, index, total_files, progress_bar)
+    summary = process_training_dataset(
+        workers=workers, on_result=on_result, retry_failed=retry_failed, execution=execution
+    )
+    st.write(summary)
 
 
 def display_extraction_results(mileage, car_type, date, time):
     """Show extraction results to user."""
-    st.toast(f"Extracted data: \n\nMileage: {mileage}\nCar type: {car_type}\nDate: {date}\nTime: {time}")
-
-
-def is_special_case(mileage, rel_path):
-    """Handle unreadable and multi-read cases."""
-    if not mileage:
-        copy_to_error_folder(rel_path, UNREADABLE)
-        return True
-
-    if isinstance(mileage, list) and len(mileage) > 1:
-        copy_to_error_folder(rel_path, MULTI_READ)
-        return True
-
-    return False
-
-
-def copy_to_error_folder(rel_path, target_folder):
-    """Copy file to appropriate error folder."""
-    source = os.path.join(TRAINING_DATASET, rel_path)
-    target = os.path.join(target_folder, os.path.basename(rel_path))
-    shutil.copy(source, target)
-
-
-def process_valid_data(file_path, date, time, mileage, car_type):
-    """Process data with valid mileage and car type."""
-    mileage = mileage[0] if isinstance(mileage, list) else mileage
-    record = {
-        "Filename": file_path,
-        "Date": str(date),
-        "Time": str(time),
-        "Mileage": mileage,
-        "Car type": car_type,
-        "Car": "",
-        "Notes": "Training Dataset",
-    }
-
-    data = load_training_json()
-    if not is_duplicate(data, record):
-        data.append(record)
-        save_training_json(data)
-
-
-def is_duplicate(data, new_record):
-    """Check if record already exists in dataset based on date and time."""
-    return any(records["Date"] == new_record["Date"] and records["Time"] == new_record["Time"] for records in data)
+    readings = ", ".join(candidate.value for candidate in mileage) or None
+    st.toast(f"Extracted data: \n\nMileage: {readings}\nCar type: {car_type}\nDate: {date}\nTime: {time}")
 
 
 def update_progress(rel_path, index, total_files, progress_bar):
@@ -88,46 +36,15 @@ def update_progress(rel_path, index, total_files, progress_bar):
     st.write(f"Processed image: {rel_path}, {index+1}/{total_files}")
 
 
-def list_dataset_files():
-    """Get all image files recursively from the training dataset and its subdirectories."""
-    filenames = []
-
-    for root, _, files in os.walk(TRAINING_DATASET):
-        for file in files:
-            file_path = os.path.join(root, file)
-            if file_path.lower().endswith((".png", ".jpg", ".jpeg")):
-                rel_path = os.path.relpath(file_path, TRAINING_DATASET)
-                filenames.append(rel_path)
-    return filenames
-
-
-def load_training_json():
-    """Load training JSON file or return empty list."""
-    try:
-        with open(TRAINING_JSON, "r") as f:
-            return json.load(f)
-    except (FileNotFoundError, json.JSONDecodeError):
-        return []
-
-
-def save_training_json(data):
-    """Save data to training JSON file."""
-    os.makedirs(os.path.dirname(TRAINING_JSON), exist_ok=True)
-    with open(TRAINING_JSON, "w") as f:
-        json.dump(data, f, indent=2)
-
-
-def create_error_folders():
-    """Create folders for problem files if they don't exist."""
-    os.makedirs(UNREADABLE, exist_ok=True)
-    os.makedirs(MULTI_READ, exist_ok=True)
-
-
+start_warm_up()
 st.title("Training Dataset Processing")
+execution = st.radio("Execution", ["batch", "pipeline"], index=["batch", "pipeline"].index(TRAINING_EXECUTION))
+workers = st.number_input("Worker processes", min_value=1, max_value=os.cpu_count() or 1, value=TRAINING_WORKERS)
+retry_failed = st.checkbox("Retry unreadable, multi-read and failed images")
 col1, col2 = st.columns(2)
 with col1:
     if st.button("Process Training Dataset"):
-        process_training_dataset()
+        run_processing(workers, retry_failed, execution)
 with col2:
     if st.button("List Dataset Files"):
         st.write(list_dataset_files())
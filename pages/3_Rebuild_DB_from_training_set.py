@@ -1,57 +1,24 @@
-import os
-
-import numpy as np
 import pandas as pd
 import streamlit as st
-from sklearn.cluster import KMeans
 
 import modules.charts as charts
-from modules.settings import JSON_FILE, TRAINING_JSON
+from modules.rebuild import (
+    cluster_by_distance_from_trend,
+    count_cars,
+    identify_car,
+    load_training_data,
+    save_to_database,
+)
+from modules.settings import STORAGE_BACKEND
 
 st.set_page_config(layout="wide")
 st.title("Rebuilding Database from Training Set")
 
 
-def cluster_by_distance_from_trend(df):
-    """Divide dataframe into clusters based on distance from trend."""
-    distance_from_trend = np.abs(df["Mileage"] - df["trend"]).values.reshape(-1, 1)
-    kmeans = KMeans(n_clusters=2, random_state=0)
-    cluster_labels = kmeans.fit_predict(distance_from_trend)
-    df["group"] = cluster_labels
-    return df
-
-
-def identify_car(df, clustered_df):
-    """Identify car subtypes based on clustering results."""
-    df["Car"] = "Scudo"
-
-    cluster = clustered_df["group"]
-    l4h2 = clustered_df[cluster == 0].index
-    l3h2 = clustered_df[cluster == 1].index
-
-    df.loc[l4h2, "Car"] = "L4H2"
-    df.loc[l3h2, "Car"] = "L3H2"
-
-    return df
-
-
-def save_data_to_json(df, target_file=JSON_FILE):
-    """Save processed data to JSON file."""
-    try:
-        df["Date"] = pd.to_datetime(df["Date"]).dt.strftime("%Y-%m-%d")
-        df["Time"] = pd.to_datetime(df["Time"]).dt.strftime("%H:%M")
-        os.makedirs(os.path.dirname(target_file), exist_ok=True)
-        df.to_json(target_file, orient="records", indent=2)
-        return True
-    except Exception as e:
-        st.error(f"Error saving data: {str(e)}")
-        return False
-
-
 def step_1_load_data():
     """Load and visualize data with car type colors."""
     st.header("1. Load training data")
-    df = charts.read_and_format_json(TRAINING_JSON)
+    df = load_training_data()
     if df.empty:
         st.warning("No training data to load.")
         return pd.DataFrame()
@@ -102,15 +69,11 @@ def step_4_identify_vehicle_types(df, df_clustered):
     st.header("4. Vehicle type identification")
 
     df_classified = identify_car(df, df_clustered)
+    counts = count_cars(df_classified)
 
-    scudo = df_classified[df_classified["Car type"] == "Osobowy"]
-    car_name = df_classified["Car"]
-    l3h2 = df_classified[car_name == "L3H2"]
-    l4h2 = df_classified[car_name == "L4H2"]
-
-    st.write(f"Osobowy Scudo: {len(scudo)} records")
-    st.write(f"Dostawczy L3H2: {len(l3h2)} records")
-    st.write(f"Dostawczy L4H2: {len(l4h2)} records")
+    st.write(f"Osobowy Scudo: {counts['Scudo']} records")
+    st.write(f"Dostawczy L3H2: {counts['L3H2']} records")
+    st.write(f"Dostawczy L4H2: {counts['L4H2']} records")
 
     chart = charts.show_chart(df_classified, legend_column="Car")
     st.altair_chart(chart, use_container_width=True)
@@ -122,10 +85,14 @@ def step_5_save_data(df_classified):
     """Save processed data to file."""
     st.header("5. Save processed data")
 
-    if st.button("Save data to JSON file"):
-        if save_data_to_json(df_classified):
-            st.success(f"Data saved to {JSON_FILE}")
-            st.balloons()
+    if st.button("Save data to database"):
+        try:
+            stored = save_to_database(df_classified)
+        except Exception as e:
+            st.error(f"Error saving data: {str(e)}")
+            return
+        st.success(f"Saved {stored} records to {STORAGE_BACKEND} database")
+        st.balloons()
 
 
 def main():
@@ -55,7 +55,7 @@ def show_car_prediction(df):
         car_type = None if car_type == "All" else car_type
 
     if st.button("Predict car"):
-        predicted_car = predict_car(mileage, prediction_date, df, car_type)
+        predicted_car = predict_car(mileage, prediction_date, car_type=car_type)
         st.success(f"Predicted car: {predicted_car}")
 
 